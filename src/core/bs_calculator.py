@@ -4,11 +4,20 @@
 """
 
 import numpy as np
-from scipy.stats import norm
+from scipy.special import ndtr
 from typing import Union, Dict, List
 import pandas as pd
 
 
+# 标准正态密度常数 1/√(2π)
+_INV_SQRT_2PI = 0.3989422804014327
+
+
+def _norm_pdf(x: Union[float, np.ndarray]) -> Union[float, np.ndarray]:
+    """标准正态密度 N'(x)（直接按公式计算，省去 norm.pdf 的分布对象开销）"""
+    return np.exp(-0.5 * x * x) * _INV_SQRT_2PI
+
+
 class BSCalculator:
     """Black-Scholes期权定价模型计算器"""
     
@@ -67,10 +76,10 @@ class BSCalculator:
         
         if option_type.lower() == 'call' or option_type.upper() == 'C':
             # Call期权价格：C = S*N(d1) - K*exp(-rT)*N(d2)
-            price = S * norm.cdf(d1) - K * np.exp(-r * T) * norm.cdf(d2)
+            price = S * ndtr(d1) - K * np.exp(-r * T) * ndtr(d2)
         else:  # put
             # Put期权价格：P = K*exp(-rT)*N(-d2) - S*N(-d1)
-            price = K * np.exp(-r * T) * norm.cdf(-d2) - S * norm.cdf(-d1)
+            price = K * np.exp(-r * T) * ndtr(-d2) - S * ndtr(-d1)
         
         return price
     
@@ -95,10 +104,10 @@ class BSCalculator:
         
         if option_type.lower() == 'call' or option_type.upper() == 'C':
             # Call Delta: Δ = N(d1)
-            delta = norm.cdf(d1)
+            delta = ndtr(d1)
         else:  # put
             # Put Delta: Δ = N(d1) - 1
-            delta = norm.cdf(d1) - 1
+            delta = ndtr(d1) - 1
         
         return delta
     
@@ -125,7 +134,7 @@ class BSCalculator:
         T = np.maximum(T, 1e-10)
         sigma = np.maximum(sigma, 1e-10)
         
-        gamma = norm.pdf(d1) / (S * sigma * np.sqrt(T))
+        gamma = _norm_pdf(d1) / (S * sigma * np.sqrt(T))
         
         return gamma
     
@@ -152,12 +161,12 @@ class BSCalculator:
         
         if option_type.lower() == 'call' or option_type.upper() == 'C':
             # Call Theta: Θ = -S*N'(d1)*σ/(2√T) - rK*exp(-rT)*N(d2)
-            theta = (-S * norm.pdf(d1) * sigma / (2 * np.sqrt(T)) 
-                    - r * K * np.exp(-r * T) * norm.cdf(d2))
+            theta = (-S * _norm_pdf(d1) * sigma / (2 * np.sqrt(T)) 
+                    - r * K * np.exp(-r * T) * ndtr(d2))
         else:  # put
             # Put Theta: Θ = -S*N'(d1)*σ/(2√T) + rK*exp(-rT)*N(-d2)
-            theta = (-S * norm.pdf(d1) * sigma / (2 * np.sqrt(T)) 
-                    + r * K * np.exp(-r * T) * norm.cdf(-d2))
+            theta = (-S * _norm_pdf(d1) * sigma / (2 * np.sqrt(T)) 
+                    + r * K * np.exp(-r * T) * ndtr(-d2))
         
         return theta
     
@@ -184,7 +193,7 @@ class BSCalculator:
         T = np.maximum(T, 1e-10)
         
         # Vega: ν = S * √T * N'(d1)
-        vega = S * np.sqrt(T) * norm.pdf(d1)
+        vega = S * np.sqrt(T) * _norm_pdf(d1)
         
         return vega
     
@@ -211,10 +220,10 @@ class BSCalculator:
         
         if option_type.lower() == 'call' or option_type.upper() == 'C':
             # Call Rho: ρ = K*T*exp(-rT)*N(d2)
-            rho = K * T * np.exp(-r * T) * norm.cdf(d2)
+            rho = K * T * np.exp(-r * T) * ndtr(d2)
         else:  # put
             # Put Rho: ρ = -K*T*exp(-rT)*N(-d2)
-            rho = -K * T * np.exp(-r * T) * norm.cdf(-d2)
+            rho = -K * T * np.exp(-r * T) * ndtr(-d2)
         
         return rho
     
@@ -245,7 +254,7 @@ class BSCalculator:
         # 标准 Vanna 公式（修正）: -N'(d1) × d2 / (S × σ)
         # 负号是关键！Vanna = ∂Vega/∂S = ∂Delta/∂σ
         # 物理含义：Vega曲线的斜率（对价格的导数）
-        vanna = -norm.pdf(d1) * d2 / (S * sigma)
+        vanna = -_norm_pdf(d1) * d2 / (S * sigma)
         
         return vanna
     
@@ -325,6 +334,59 @@ class BSCalculator:
         
         return result
     
+    def calculate_chain_greeks(self, S: float, K: np.ndarray, T: np.ndarray, sigma: np.ndarray,
+                               is_call: np.ndarray, r: float = None,
+                               include_price_theta_rho: bool = False) -> Dict[str, np.ndarray]:
+        """
+        整条期权链一次性计算 Delta/Gamma/Vega/Volga/Vanna（支持Call/Put混合）
+        d1、d2、√T、N'(d1)、N(d1) 各只计算一次，Gamma/Vega/Volga/Vanna 只用乘除从 N'(d1) 推导
+        
+        :param S: 标的价格
+        :param K: 行权价数组
+        :param T: 到期时间数组（年）
+        :param sigma: 波动率数组（年化）
+        :param is_call: 布尔数组，True为Call，False为Put
+        :param r: 无风险利率
+        :param include_price_theta_rho: 是否同时计算价格、Theta（年化）和Rho
+        :return: 包含 delta/gamma/vega/volga/vanna（及 price/theta/rho）数组的字典
+        """
+        if r is None:
+            r = self.risk_free_rate
+        
+        # 避免除零错误（与单项Greeks方法一致）
+        T = np.maximum(T, 1e-10)
+        sigma = np.maximum(sigma, 1e-10)
+        
+        sqrt_T = np.sqrt(T)
+        sigma_sqrt_T = sigma * sqrt_T
+        d1 = (np.log(S / K) + (r + 0.5 * sigma**2) * T) / sigma_sqrt_T
+        d2 = d1 - sigma_sqrt_T
+        
+        # 共享中间量：N'(d1) 和 N(d1)（ndtr 直接调用ufunc，省去 norm.cdf 的分布对象开销）
+        pdf_d1 = _norm_pdf(d1)
+        cdf_d1 = ndtr(d1)
+        
+        vega = S * sqrt_T * pdf_d1
+        
+        result = {
+            'delta': np.where(is_call, cdf_d1, cdf_d1 - 1),  # Put Delta = N(d1) - 1
+            'gamma': pdf_d1 / (S * sigma_sqrt_T),
+            'vega': vega,
+            'volga': vega * d1 * d2 / sigma,
+            'vanna': -pdf_d1 * d2 / (S * sigma)
+        }
+        
+        if include_price_theta_rho:
+            # Put 使用 N(-d1)、N(-d2)，与单项方法一致（不用 1-N(x)，避免深度虚值时的精度损失）
+            K_disc = K * np.exp(-r * T)
+            cdf_d2 = np.where(is_call, ndtr(d2), ndtr(-d2))
+            sign = np.where(is_call, 1.0, -1.0)
+            result['price'] = np.where(is_call, S * cdf_d1 - K_disc * cdf_d2, K_disc * cdf_d2 - S * ndtr(-d1))
+            result['theta'] = -S * pdf_d1 * sigma / (2 * sqrt_T) - sign * r * K_disc * cdf_d2
+            result['rho'] = sign * K_disc * T * cdf_d2
+        
+        return result
+    
     def price_scenario_analysis(self, K: float, T: float, sigma: float, 
                                 option_type: str = 'call', 
                                 S_min: float = None, S_max: float = None, 
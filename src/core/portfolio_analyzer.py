@@ -255,6 +255,75 @@ class PortfolioAnalyzer:
             'position_value': total_value
         }
     
+    def calculate_portfolio_greeks_batch(self, spot_price: float = None,
+                                         current_date: datetime = None,
+                                         volatility_multiplier: float = 1.0,
+                                         time_days_offset: int = 0) -> Dict:
+        """
+        向量化计算组合的总Greeks（结果与 calculate_portfolio_greeks 一致）
+        所有持仓的行权价/到期时间/波动率/类型打包为数组，一次BS计算后按数量加权求和
+        
+        :param spot_price: 标的价格（如果None，使用current_spot_price）
+        :param current_date: 当前日期
+        :param volatility_multiplier: 波动率倍数（1.0表示无变化，1.1表示+10%，0.9表示-10%）
+        :param time_days_offset: 时间偏移天数（0表示当前，正数表示未来）
+        :return: 组合Greeks字典
+        """
+        if spot_price is None:
+            spot_price = self.current_spot_price
+        
+        if not self.positions:
+            return self.calculate_portfolio_greeks(spot_price)
+        
+        # 计算调整后的日期
+        if current_date is None:
+            current_date = datetime.now()
+        adjusted_date = current_date + timedelta(days=time_days_offset)
+        
+        # 持仓属性打包为连续数组（每次调用时读取，持仓IV被外部更新后也能反映）
+        strikes = np.array([pos.strike for pos in self.positions], dtype=np.float64)
+        quantities = np.array([pos.quantity for pos in self.positions], dtype=np.float64)
+        volatilities = np.array([pos.volatility for pos in self.positions], dtype=np.float64) * volatility_multiplier
+        is_call = np.array([pos.option_type.upper() == 'C' for pos in self.positions])
+        expirations = pd.DatetimeIndex([pos.expiration_date for pos in self.positions])
+        
+        # 剩余时间与 Position.time_to_maturity 口径一致：按整天数（向下取整，不小于0）/ 365
+        days = np.maximum((expirations - pd.to_datetime(adjusted_date)).days.to_numpy(), 0)
+        T = days / 365.0
+        
+        # 未到期持仓一次性计算BS Greeks
+        live = T > 0.001
+        greeks = self.bs_calculator.calculate_chain_greeks(
+            spot_price, strikes[live], T[live], volatilities[live], is_call[live],
+            include_price_theta_rho=True
+        )
+        q_live = quantities[live]
+        totals = {name: float(greeks[name] @ q_live)
+                  for name in ('delta', 'gamma', 'theta', 'vega', 'rho', 'vanna', 'volga', 'price')}
+        
+        # 已到期或接近到期（T <= 0.001年）的持仓使用内在价值，Delta为0/±1，其他Greeks为0
+        expired = ~live
+        K_exp = strikes[expired]
+        call_exp = is_call[expired]
+        q_exp = quantities[expired]
+        intrinsic_value = np.where(call_exp, np.maximum(spot_price - K_exp, 0.0), np.maximum(K_exp - spot_price, 0.0))
+        expired_delta = np.where(call_exp, (spot_price > K_exp).astype(np.float64), -(spot_price < K_exp).astype(np.float64))
+        totals['delta'] += float(expired_delta @ q_exp)
+        totals['price'] += float(intrinsic_value @ q_exp)
+        
+        return {
+            'delta': totals['delta'],
+            'gamma': totals['gamma'],
+            'theta': totals['theta'],
+            'theta_daily': totals['theta'] / 365,
+            'vega': totals['vega'],
+            'vega_percent': totals['vega'] / 100,
+            'rho': totals['rho'],
+            'vanna': totals['vanna'],
+            'volga': totals['volga'],
+            'position_value': totals['price']
+        }
+    
     def calculate_single_position_greeks(self, position: Position, spot_price: float = None,
                                          elapsed_days: int = 0, current_date: datetime = None,
                                          volatility_multiplier: float = 1.0) -> Dict:
@@ -266,6 +266,45 @@ def test_vectorization():
     return True
 
 
+def test_chain_greeks():
+    """测试用例10：期权链批量Greeks与单项计算一致"""
+    print("\n" + "="*60)
+    print("测试用例10：期权链批量Greeks测试")
+    print("="*60)
+    
+    bs = BSCalculator()
+    
+    S = 3000
+    K = np.array([2500, 2800, 3000, 3000, 3200, 3500])
+    T = np.array([7, 30, 30, 90, 60, 180]) / 365
+    sigma = np.array([0.9, 0.7, 0.6, 0.65, 0.8, 1.1])
+    is_call = np.array([True, False, True, False, True, False])
+    
+    greeks = bs.calculate_chain_greeks(S, K, T, sigma, is_call, include_price_theta_rho=True)
+    
+    def by_type(method):
+        return np.where(is_call, method(S, K, T, sigma, 'call'), method(S, K, T, sigma, 'put'))
+    
+    expected = {
+        'delta': by_type(bs.calculate_delta),
+        'gamma': bs.calculate_gamma(S, K, T, sigma),
+        'vega': bs.calculate_vega(S, K, T, sigma),
+        'volga': bs.calculate_volga(S, K, T, sigma),
+        'vanna': bs.calculate_vanna(S, K, T, sigma),
+        'price': by_type(bs.calculate_option_price),
+        'theta': by_type(bs.calculate_theta),
+        'rho': by_type(bs.calculate_rho)
+    }
+    
+    for name, values in expected.items():
+        max_diff = np.max(np.abs(greeks[name] - values))
+        print(f"  {name}: 最大偏差 = {max_diff:.2e}")
+        assert np.allclose(greeks[name], values, rtol=1e-10, atol=1e-12), f"{name} 与单项计算不一致"
+    
+    print("✓ 期权链批量Greeks测试通过")
+    return True
+
+
 def main():
     """运行所有测试用例"""
     print("="*60)
@@ -284,6 +323,7 @@ def main():
     test_results.append(("测试7：Vega正值", test_vega_positive()))
     test_results.append(("测试8：情景分析", test_scenario_analysis()))
     test_results.append(("测试9：向量化计算", test_vectorization()))
+    test_results.append(("测试10：期权链批量Greeks", test_chain_greeks()))
     
     # 汇总结果
     print("\n" + "="*60)
@@ -3,6 +3,7 @@
 """
 
 from src.core import PortfolioAnalyzer
+from datetime import datetime, timedelta
 import sys
 
 
@@ -240,6 +241,37 @@ def test_volatility_sensitivity():
     return True
 
 
+def test_batch_greeks():
+    """测试用例9：向量化组合Greeks与逐持仓计算一致"""
+    print("\n" + "="*60)
+    print("测试用例9：向量化组合Greeks测试")
+    print("="*60)
+    
+    analyzer = PortfolioAnalyzer()
+    analyzer.current_spot_price = 3000
+    
+    # 使用相对日期，包含已到期和当天到期的持仓（走内在价值分支）
+    today = datetime.now()
+    for days, strike, option_type, quantity, vol in [(30, 3000, 'C', 2, 0.8), (30, 3000, 'P', -1, 0.8),
+                                                     (90, 2500, 'P', 3, 0.6), (7, 3500, 'C', 5, 1.1),
+                                                     (0, 2800, 'C', 1, 0.7), (-5, 3200, 'P', -2, 0.7)]:
+        exp_date = (today + timedelta(days=days)).strftime('%Y-%m-%d')
+        analyzer.add_position(exp_date, strike, option_type, quantity, volatility=vol)
+    
+    scenarios = [{}, {'volatility_multiplier': 1.2}, {'time_days_offset': 10}, {'spot_price': 3100}]
+    for kwargs in scenarios:
+        expected = analyzer.calculate_portfolio_greeks(**kwargs)
+        greeks = analyzer.calculate_portfolio_greeks_batch(**kwargs)
+        
+        max_diff = max(abs(greeks[name] - value) / max(1.0, abs(value)) for name, value in expected.items())
+        print(f"  情景 {kwargs or '当前'}: 最大相对偏差 = {max_diff:.2e}")
+        assert greeks.keys() == expected.keys(), "返回的Greeks字段应一致"
+        assert max_diff < 1e-9, "向量化组合Greeks与逐持仓计算不一致"
+    
+    print("✓ 向量化组合Greeks测试通过")
+    return True
+
+
 def main():
     """运行所有测试"""
     print("="*60)
@@ -256,6 +288,7 @@ def main():
     test_results.append(("测试6：PnL计算", test_pnl_calculation()))
     test_results.append(("测试7：时间衰减", test_time_decay()))
     test_results.append(("测试8：波动率敏感性", test_volatility_sensitivity()))
+    test_results.append(("测试9：向量化组合Greeks", test_batch_greeks()))
     
     # 汇总
     print("\n" + "="*60)
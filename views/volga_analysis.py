@@ -3,14 +3,18 @@ Volga分析视图
 基于期权链快照进行二阶风险分析：Volga-Vega散点图、IV-Vega收益热力图、Volga损耗计算器
 """
 
+import hashlib
+import heapq
+from dataclasses import dataclass
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 import plotly.express as px
+from scipy.stats import rankdata
 from datetime import datetime, timedelta
 from typing import List, Dict
-from src.core import OptionsDatabase, BSCalculator, PortfolioAnalyzer
+from src.core import OptionsDatabase, BSCalculator
 from src.utils import load_data
 
 
@@ -33,6 +37,137 @@ def safe_get_instrument_name(row):
     return str(name)
 
 
+def format_numbers(values: pd.Series, fmt: str) -> pd.Series:
+    """
+    向量化数值格式化（替代逐行f-string）
+    
+    :param values: 数值序列
+    :param fmt: printf风格格式，如 '%.2f'
+    :return: 格式化后的字符串序列（索引与输入一致）
+    """
+    return pd.Series(np.char.mod(fmt, values.to_numpy(dtype=np.float64)), index=values.index)
+
+
+def safe_get_instrument_names(df: pd.DataFrame) -> pd.Series:
+    """
+    批量获取合约名称（safe_get_instrument_name 的向量化版本）
+    
+    :param df: 期权链数据
+    :return: 合约名称序列，缺失时使用"类型-行权价"格式
+    """
+    opt_type = df['option_type'].astype(str) if 'option_type' in df.columns else pd.Series('?', index=df.index)
+    strike = df['strike'] if 'strike' in df.columns else pd.Series(0.0, index=df.index)
+    fallback = opt_type + '-' + format_numbers(strike, '%.0f')
+    
+    if 'instrument_name' not in df.columns:
+        return fallback
+    
+    names = df['instrument_name']
+    valid = names.notna() & (names.astype(str) != '')
+    return names.astype(str).where(valid, fallback)
+
+
+def top_k_positions(values: np.ndarray, k: int, largest: bool = True) -> np.ndarray:
+    """
+    用部分选择（argpartition，O(N)）找出前k个元素的位置，替代整列排序
+    
+    :param values: 数值数组
+    :param k: 需要的个数
+    :param largest: True取最大的k个，False取最小的k个
+    :return: 位置数组，按值排序（largest时从大到小）
+    """
+    keys = -values if largest else values
+    k = min(k, len(keys))
+    if k <= 0:
+        return np.array([], dtype=np.intp)
+    
+    idx = np.argpartition(keys, k - 1)[:k]
+    return idx[np.argsort(keys[idx], kind='stable')]
+
+
+_GREEK_COLUMNS = ['delta', 'gamma', 'vega', 'volga', 'vanna']
+
+
+@dataclass
+class ChainSoA:
+    """
+    期权链的列式（SoA）快照：只保留Greeks完整的合约，每个字段都是连续的ndarray
+    每个快照只构建一次，各渲染模块直接读取字段，不再每次重跑都切片/复制DataFrame
+    """
+    key: str  # 快照键（来自 prepare_volga_data 写入的 df.attrs['snapshot_key']）
+    rows: np.ndarray  # 有效合约在原DataFrame中的位置
+    strike: np.ndarray
+    option_type: np.ndarray
+    delta: np.ndarray
+    gamma: np.ndarray
+    vega: np.ndarray
+    volga: np.ndarray
+    vanna: np.ndarray
+    mark_iv_decimal: np.ndarray
+    iv_percentile: np.ndarray
+    name: np.ndarray  # 合约名称（缺失时为"类型-行权价"）
+    label: np.ndarray  # 合约选择器显示名称
+
+
+def build_chain_soa(df: pd.DataFrame) -> ChainSoA:
+    """
+    把 prepare_volga_data 的输出转换为 ChainSoA
+    
+    :param df: 包含所有Greeks的DataFrame
+    :return: ChainSoA
+    """
+    greeks = df[_GREEK_COLUMNS].to_numpy()
+    rows = np.flatnonzero(~np.isnan(greeks).any(axis=1))
+    valid = df.take(rows)
+    delta, gamma, vega, volga, vanna = np.ascontiguousarray(greeks[rows].T)
+    
+    names = safe_get_instrument_names(valid)
+    label = (names +
+             ' | 行权价:' + format_numbers(valid['strike'], '%.0f') +
+             ' | ' + valid['option_type'].astype(str) +
+             ' | Vega:' + format_numbers(valid['vega'], '%.2f') +
+             ' | Volga:' + format_numbers(valid['volga'], '%.2f'))
+    
+    if 'iv_percentile' in valid.columns:
+        iv_percentile = valid['iv_percentile'].to_numpy(dtype=np.float64)
+    else:
+        iv_percentile = np.full(len(valid), 50.0)
+    
+    return ChainSoA(
+        key=df.attrs.get('snapshot_key', ''),
+        rows=rows,
+        strike=valid['strike'].to_numpy(dtype=np.float64),
+        option_type=valid['option_type'].astype(str).to_numpy(),
+        delta=delta,
+        gamma=gamma,
+        vega=vega,
+        volga=volga,
+        vanna=vanna,
+        mark_iv_decimal=valid['mark_iv_decimal'].to_numpy(dtype=np.float64),
+        iv_percentile=iv_percentile,
+        name=names.to_numpy(),
+        label=label.to_numpy()
+    )
+
+
+def get_chain_soa(df: pd.DataFrame) -> ChainSoA:
+    """
+    获取当前快照的 ChainSoA（存放在 st.session_state['chain_soa']，快照键不变时直接复用）
+    
+    :param df: 包含所有Greeks的DataFrame
+    :return: ChainSoA
+    """
+    key = df.attrs.get('snapshot_key')
+    soa = st.session_state.get('chain_soa')
+    if key and soa is not None and soa.key == key:
+        return soa
+    
+    soa = build_chain_soa(df)
+    if key:
+        st.session_state['chain_soa'] = soa
+    return soa
+
+
 def calculate_iv_percentile(df: pd.DataFrame, iv_col: str = 'mark_iv') -> pd.Series:
     """
     计算IV百分位（简化版：基于当前期权链的分布）
@@ -42,101 +177,164 @@ def calculate_iv_percentile(df: pd.DataFrame, iv_col: str = 'mark_iv') -> pd.Ser
     :param iv_col: IV列名
     :return: IV百分位序列（0-100）
     """
+    # 缺失值默认为50
+    result = np.full(len(df), 50.0)
     if df.empty or iv_col not in df.columns:
-        return pd.Series([50.0] * len(df), index=df.index)
+        return pd.Series(result, index=df.index)
+    
+    iv_values = df[iv_col].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(iv_values)
+    n_valid = int(valid.sum())
+    if n_valid == 0:
+        return pd.Series(result, index=df.index)
+    
+    # 使用当前快照的分布计算百分位（直接在ndarray上排名，并列取平均名次）
+    result[valid] = rankdata(iv_values[valid]) / n_valid * 100
+    return pd.Series(result, index=df.index)
+
+
+# Greeks缓存版本：_compute_volga_data 的输出列或计算口径变化时递增
+# （st.cache_data 只按被装饰函数自身的源码失效，不会感知其调用的函数的改动）
+_CACHE_VERSION = 4
+
+
+def _snapshot_key(df: pd.DataFrame) -> str:
+    """
+    计算期权链快照指纹（用作缓存键，包含缓存版本）
     
-    iv_values = df[iv_col].dropna()
-    if len(iv_values) == 0:
-        return pd.Series([50.0] * len(df), index=df.index)
+    :param df: 期权链数据
+    :return: 快照指纹字符串
+    """
+    # categorize=False：合约名称等字符串列几乎全部唯一，先去重再哈希反而多一遍哈希表构建，直接逐值哈希约快一倍
+    hashed = pd.util.hash_pandas_object(df, index=False, categorize=False).values
+    return f"v{_CACHE_VERSION}:{hashlib.md5(hashed.tobytes()).hexdigest()}"
+
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)  # 与 load_data 相同的60秒有效期
+def _prepare_volga_data_cached(snapshot_key: str, spot_price: float, risk_free_rate: float,
+                               use_float32: bool, valuation_date: pd.Timestamp,
+                               _df: pd.DataFrame) -> pd.DataFrame:
+    """
+    按 (快照指纹, 标的价格, 无风险利率, 估值日期) 缓存Greeks计算结果
+    滑杆等交互触发的重跑直接复用缓存，不再重新计算整条期权链的Greeks
     
-    # 使用当前快照的分布计算百分位
-    percentiles = iv_values.rank(pct=True) * 100
-    # 填充缺失值
-    result = pd.Series([50.0] * len(df), index=df.index)
-    result.loc[iv_values.index] = percentiles
-    return result
+    :param snapshot_key: 快照指纹（_df 本身不参与哈希）
+    :param spot_price: 当前标的价格
+    :param risk_free_rate: 无风险利率
+    :param use_float32: Greeks列是否以float32存储
+    :param valuation_date: 估值日期（当天零点）。剩余天数按当前时刻计算，到期日为零点时只在跨日时变化，
+                           因此只作为缓存键：跨日后重新计算剩余期限并剔除已到期合约
+    :param _df: 期权链数据（使用_前缀避免缓存哈希）
+    :return: 包含所有Greeks的DataFrame
+    """
+    return _compute_volga_data(_df, spot_price, risk_free_rate, use_float32)
 
 
-def prepare_volga_data(df: pd.DataFrame, spot_price: float, risk_free_rate: float = 0.05) -> pd.DataFrame:
+def prepare_volga_data(df: pd.DataFrame, spot_price: float, risk_free_rate: float = 0.05,
+                       use_float32: bool = True) -> pd.DataFrame:
     """
     为期权链数据计算所有Greeks（Delta, Gamma, Vega, Volga, Vanna）
-    用于完整泰勒展开PnL计算
+    用于完整泰勒展开PnL计算；同一快照、相同参数的结果会被缓存
     
     :param df: 期权链数据
     :param spot_price: 当前标的价格
     :param risk_free_rate: 无风险利率
+    :param use_float32: Greeks列是否以float32存储（默认开启，展示和排序不需要float64精度；
+                        需要核对精度时可传False）
     :return: 包含所有Greeks的DataFrame
     """
     if df.empty:
         return pd.DataFrame()
     
-    result_df = df.copy()
+    snapshot_key = _snapshot_key(df)
+    valuation_date = pd.Timestamp.now().normalize()
+    result_df = _prepare_volga_data_cached(snapshot_key, spot_price, risk_free_rate, use_float32,
+                                           valuation_date, df)
+    
+    # 记录快照键（含计算参数和估值日期），下游据此复用 ChainSoA 等派生结果，跨日后一并失效
+    result_df.attrs['snapshot_key'] = (f"{snapshot_key}:{spot_price}:{risk_free_rate}:{use_float32}:"
+                                       f"{valuation_date.date()}")
+    return result_df
+
+
+def _compute_volga_data(df: pd.DataFrame, spot_price: float, risk_free_rate: float = 0.05,
+                        use_float32: bool = True) -> pd.DataFrame:
+    """
+    计算期权链的所有Greeks（未缓存版本，由 prepare_volga_data 调用）
+    
+    :param df: 期权链数据
+    :param spot_price: 当前标的价格
+    :param risk_free_rate: 无风险利率
+    :param use_float32: Greeks列是否以float32存储
+    :return: 包含所有Greeks的DataFrame
+    """
     bs_calc = BSCalculator(risk_free_rate=risk_free_rate)
     
     # 确保必要的列存在
     required_cols = ['strike', 'expiration_date', 'mark_iv', 'option_type']
-    missing_cols = [col for col in required_cols if col not in result_df.columns]
+    missing_cols = [col for col in required_cols if col not in df.columns]
     if missing_cols:
         st.warning(f"缺少必要列: {missing_cols}")
         return pd.DataFrame()
     
-    # 计算到期时间（年）
-    result_df['expiration_date'] = pd.to_datetime(result_df['expiration_date'])
+    # 计算剩余天数
+    expiration_date = pd.to_datetime(df['expiration_date'])
     current_date = pd.Timestamp.now()
-    result_df['days_to_expiry'] = (result_df['expiration_date'] - current_date).dt.days
-    result_df['time_to_maturity'] = result_df['days_to_expiry'] / 365.0
-    result_df['time_to_maturity'] = result_df['time_to_maturity'].clip(lower=1e-6)  # 避免除零
+    days_to_expiry = (expiration_date - current_date).dt.days.to_numpy()
     
-    # 过滤掉已到期的期权
-    result_df = result_df[result_df['days_to_expiry'] > 0].copy()
-    
-    if result_df.empty:
+    # 过滤掉已到期的期权（take只生成一份副本，后续直接在其上添加列）
+    keep = np.flatnonzero(days_to_expiry > 0)
+    if len(keep) == 0:
         return pd.DataFrame()
     
+    result_df = df.take(keep)
+    result_df['expiration_date'] = expiration_date.to_numpy()[keep]
+    result_df['days_to_expiry'] = days_to_expiry[keep]
+    result_df['time_to_maturity'] = np.maximum(days_to_expiry[keep] / 365.0, 1e-6)  # 计算到期时间（年），避免除零
+    
     # 准备计算参数
     S = spot_price
     K = result_df['strike'].values
     T = result_df['time_to_maturity'].values
-    sigma = result_df['mark_iv'].fillna(0.5).values  # 缺失IV用0.5填充
-    option_types = result_df['option_type'].values
+    option_types = result_df['option_type'].to_numpy()
     
-    # 检测IV数据格式
-    iv_max = result_df['mark_iv'].max()
-    is_percentage_format = iv_max > 1.0
+    # 检测IV数据格式（只在此处检测一次，下游统一读取 mark_iv_decimal）
+    mark_iv = result_df['mark_iv'].to_numpy(dtype=np.float64)
+    is_percentage_format = np.nanmax(mark_iv, initial=0.0) > 1.0
     if is_percentage_format:
-        sigma = sigma / 100.0  # 转换为小数形式用于计算
-    
-    # 批量计算所有Greeks（使用calculate_all_greeks方法）
-    deltas = []
-    gammas = []
-    vegas = []
-    volgas = []
-    vannas = []
-    
-    for i in range(len(result_df)):
-        opt_type = 'call' if option_types[i] == 'C' else 'put'
-        greeks = bs_calc.calculate_all_greeks(S, K[i], T[i], sigma[i], opt_type)
-        
-        deltas.append(greeks.get('delta', 0))
-        gammas.append(greeks.get('gamma', 0))
-        vegas.append(greeks.get('vega', 0))
-        volgas.append(greeks.get('volga', 0))
-        vannas.append(greeks.get('vanna', 0))
-    
-    result_df['delta'] = deltas
-    result_df['gamma'] = gammas
-    result_df['vega'] = vegas
-    result_df['volga'] = volgas
-    result_df['vanna'] = vannas
-    
-    # 保存原始IV格式用于显示
-    if is_percentage_format:
-        result_df['mark_iv_decimal'] = sigma
-    else:
-        result_df['mark_iv_decimal'] = result_df['mark_iv'].fillna(0.5)
-    
-    # 计算IV百分位
-    result_df['iv_percentile'] = calculate_iv_percentile(result_df, 'mark_iv')
+        mark_iv = mark_iv / 100.0  # 转换为小数形式用于计算
+    sigma = np.where(np.isnan(mark_iv), 0.5, mark_iv)  # 缺失IV用0.5（50%）填充
+    
+    # 整条期权链一次性计算Greeks（d1/d2和N'(d1)只计算一次，各Greeks共享）
+    greeks = bs_calc.calculate_chain_greeks(S, K, T, sigma, option_types == 'C')
+    deltas = greeks['delta']
+    gammas = greeks['gamma']
+    vegas = greeks['vega']
+    volgas = greeks['volga']
+    vannas = greeks['vanna']
+    
+    # 计算用float64保证d1/d2精度，存储用float32（列宽减半，下游PnL扫描和聚合更快）
+    greek_dtype = np.float32 if use_float32 else np.float64
+    result_df['delta'] = deltas.astype(greek_dtype)
+    result_df['gamma'] = gammas.astype(greek_dtype)
+    result_df['vega'] = vegas.astype(greek_dtype)
+    result_df['volga'] = volgas.astype(greek_dtype)
+    result_df['vanna'] = vannas.astype(greek_dtype)
+    
+    # 小数形式的IV，供PnL计算和图表显示使用
+    result_df['mark_iv_decimal'] = sigma
+    
+    # 计算IV百分位（只用于扫描器阈值过滤，与Greeks同样以float32存储；
+    # mark_iv_decimal 会回写到持仓做BS定价，保持float64）
+    result_df['iv_percentile'] = calculate_iv_percentile(result_df, 'mark_iv').astype(greek_dtype)
+    
+    # 只用于展示的原始价格/IV列同样降为float32，期权类型（只有C/P）转为分类类型；
+    # strike 保持float64：持仓按行权价精确匹配快照合约，float32 会让 2083.33 之类的行权价匹配失败
+    if use_float32:
+        for col in ('mark_iv', 'mark_price'):
+            if col in result_df.columns:
+                result_df[col] = result_df[col].astype(np.float32)
+    result_df['option_type'] = result_df['option_type'].astype('category')
     
     return result_df
 
@@ -183,8 +381,9 @@ def render_volga_vega_scatter(df: pd.DataFrame):
     if 'iv_percentile' in df.columns:
         plot_cols.append('iv_percentile')
     
-    plot_df = df[[col for col in plot_cols if col in df.columns]].copy()
-    plot_df = plot_df.dropna(subset=['vega', 'volga'])
+    # 散点、数据点数和统计量统一使用快照SoA的有效行（所有Greeks均非NaN）
+    soa = get_chain_soa(df)
+    plot_df = df[[col for col in plot_cols if col in df.columns]].take(soa.rows)
     
     if plot_df.empty:
         st.warning("没有有效的Vega/Volga数据")
@@ -246,17 +445,19 @@ def render_volga_vega_scatter(df: pd.DataFrame):
         )
     
     # 添加风险区域标注
-    if len(plot_df) > 0:
-        fig.add_annotation(
-            x=plot_df['vega'].quantile(0.9),
-            y=plot_df['volga'].quantile(0.9),
-            text="三重高危区域<br>（高Vega+高Volga+高Vanna）" if has_vanna else "高风险区域<br>（高Vega+高Volga+高IV）",
-            showarrow=True,
-            arrowhead=2,
-            arrowcolor="red",
-            bgcolor="rgba(255,0,0,0.2)",
-            bordercolor="red"
-        )
+    # 统计量直接读取快照的SoA数组（与plot_df行一一对应）；最小值/80%/90%分位/最大值一次percentile调用算出
+    vega_min, vega_q80, vega_q90, vega_max = np.percentile(soa.vega, [0, 80, 90, 100])
+    volga_min, volga_q80, volga_q90, volga_max = np.percentile(soa.volga, [0, 80, 90, 100])
+    fig.add_annotation(
+        x=vega_q90,
+        y=volga_q90,
+        text="三重高危区域<br>（高Vega+高Volga+高Vanna）" if has_vanna else "高风险区域<br>（高Vega+高Volga+高IV）",
+        showarrow=True,
+        arrowhead=2,
+        arrowcolor="red",
+        bgcolor="rgba(255,0,0,0.2)",
+        bordercolor="red"
+    )
     
     fig.update_layout(
         height=600,
@@ -271,19 +472,26 @@ def render_volga_vega_scatter(df: pd.DataFrame):
     with col1:
         st.metric("数据点数", len(plot_df))
     with col2:
-        high_risk_count = len(plot_df[(plot_df['vega'] > plot_df['vega'].quantile(0.8)) & 
-                                     (plot_df['volga'] > plot_df['volga'].quantile(0.8)) &
-                                     (plot_df['iv_percentile'] > 80)])
+        high_risk_count = int(np.count_nonzero((soa.vega > vega_q80) &
+                                               (soa.volga > volga_q80) &
+                                               (soa.iv_percentile > 80)))
         st.metric("高风险合约数", high_risk_count)
     with col3:
-        st.metric("Vega范围", f"{plot_df['vega'].min():.2f} ~ {plot_df['vega'].max():.2f}")
+        st.metric("Vega范围", f"{vega_min:.2f} ~ {vega_max:.2f}")
     with col4:
-        st.metric("Volga范围", f"{plot_df['volga'].min():.2f} ~ {plot_df['volga'].max():.2f}")
+        st.metric("Volga范围", f"{volga_min:.2f} ~ {volga_max:.2f}")
 
 
-def calculate_full_pnl(df: pd.DataFrame, spot_price: float, price_change_pct: float, iv_change_pct: float) -> pd.DataFrame:
+# calculate_full_pnl 输出的PnL归因列
+_PNL_COLUMNS = ['pnl_price_delta', 'pnl_price_gamma', 'pnl_price_total',
+                'pnl_vol_vega', 'pnl_vol_volga', 'pnl_vol_total',
+                'pnl_interaction', 'pnl_total']
+
+
+def calculate_pnl_components(df: pd.DataFrame, spot_price: float, price_change_pct: float,
+                             iv_change_pct: float) -> Dict[str, np.ndarray]:
     """
-    使用完整泰勒展开计算PnL
+    使用完整泰勒展开计算PnL归因分量（只返回新列，不复制输入DataFrame）
     
     PnL = Delta * dS + 0.5 * Gamma * dS^2 + Vega * dVol + 0.5 * Volga * dVol^2 + Vanna * dS * dVol
     
@@ -291,43 +499,119 @@ def calculate_full_pnl(df: pd.DataFrame, spot_price: float, price_change_pct: fl
     :param spot_price: 当前标的价格
     :param price_change_pct: 价格变动百分比（如+2表示+2%）
     :param iv_change_pct: IV变动百分比（如-3表示-3%）
-    :return: 添加了PnL归因列的DataFrame
+    :return: {PnL列名: ndarray}，顺序同 _PNL_COLUMNS
     """
-    result_df = df.copy()
-    
     # 转换为绝对变动
     dS = spot_price * price_change_pct / 100.0  # 价格绝对变动
     dVol = iv_change_pct / 100.0  # IV相对变动（小数形式）
     
-    # 确保IV是小数形式
-    if 'mark_iv_decimal' in result_df.columns:
-        current_iv = result_df['mark_iv_decimal']
-    else:
-        # 检测格式
-        iv_max = result_df['mark_iv'].max()
-        if iv_max > 1.0:
-            current_iv = result_df['mark_iv'] / 100.0
-        else:
-            current_iv = result_df['mark_iv']
-    
-    # 计算PnL归因
-    # 价格效应（一阶+二阶）
-    result_df['pnl_price_delta'] = result_df['delta'] * dS
-    result_df['pnl_price_gamma'] = 0.5 * result_df['gamma'] * dS * dS
-    result_df['pnl_price_total'] = result_df['pnl_price_delta'] + result_df['pnl_price_gamma']
+    # 一次性取出Greeks为连续数组，避免逐列的pandas对齐开销
+    # Greeks全部为float32时保持float32计算，否则按float64计算
+    greek_cols = df[['delta', 'gamma', 'vega', 'volga', 'vanna']]
+    dtype = np.float32 if (greek_cols.dtypes == np.float32).all() else np.float64
+    greeks = greek_cols.to_numpy(dtype=dtype)
+    delta, gamma, vega, volga, vanna = greeks.T
+    
+    # 标量系数只计算一次（百分比显示的 ×100 也并入系数），并转换为同一精度
+    dS2_half = dtype(0.5 * dS * dS)
+    dVol_pct = dtype(dVol * 100)
+    dVol2_half_pct = dtype(0.5 * dVol * dVol * 100)
+    dS_dVol_pct = dtype(dS * dVol * 100)
+    dS = dtype(dS)
+    
+    # 计算PnL归因（每个分量占一行，按列顺序对应 _PNL_COLUMNS）
+    pnl = np.empty((len(_PNL_COLUMNS), len(df)), dtype=dtype)
+    
+    # 快速路径：价格或IV不变时，相关分量恒为0，只计算另一侧
+    if dS == 0:
+        pnl[[0, 1, 2, 6]] = 0  # 价格效应和交互效应
+        np.multiply(vega, dVol_pct, out=pnl[3])
+        np.multiply(volga, dVol2_half_pct, out=pnl[4])
+        np.add(pnl[3], pnl[4], out=pnl[5])
+        pnl[7] = pnl[5]
+        return dict(zip(_PNL_COLUMNS, pnl))
+    
+    if dVol == 0:
+        pnl[3:7] = 0  # 波动率效应和交互效应
+        np.multiply(delta, dS, out=pnl[0])
+        np.multiply(gamma, dS2_half, out=pnl[1])
+        np.add(pnl[0], pnl[1], out=pnl[2])
+        pnl[7] = pnl[2]
+        return dict(zip(_PNL_COLUMNS, pnl))
     
+    # 价格效应（一阶+二阶）
+    np.multiply(delta, dS, out=pnl[0])
+    np.multiply(gamma, dS2_half, out=pnl[1])
+    np.add(pnl[0], pnl[1], out=pnl[2])
     # 波动率效应（一阶+二阶）
-    result_df['pnl_vol_vega'] = result_df['vega'] * dVol * 100  # 转换为百分比显示
-    result_df['pnl_vol_volga'] = 0.5 * result_df['volga'] * dVol * dVol * 100  # 转换为百分比显示
-    result_df['pnl_vol_total'] = result_df['pnl_vol_vega'] + result_df['pnl_vol_volga']
-    
+    np.multiply(vega, dVol_pct, out=pnl[3])
+    np.multiply(volga, dVol2_half_pct, out=pnl[4])
+    np.add(pnl[3], pnl[4], out=pnl[5])
     # 交互效应（Vanna）
-    result_df['pnl_interaction'] = result_df['vanna'] * dS * dVol * 100  # 转换为百分比显示
-    
+    np.multiply(vanna, dS_dVol_pct, out=pnl[6])
     # 总PnL
-    result_df['pnl_total'] = result_df['pnl_price_total'] + result_df['pnl_vol_total'] + result_df['pnl_interaction']
+    np.add(pnl[2], pnl[5], out=pnl[7])
+    pnl[7] += pnl[6]
     
-    return result_df
+    return dict(zip(_PNL_COLUMNS, pnl))
+
+
+def calculate_full_pnl(df: pd.DataFrame, spot_price: float, price_change_pct: float, iv_change_pct: float) -> pd.DataFrame:
+    """
+    使用完整泰勒展开计算PnL，并把归因列直接添加到传入的DataFrame上（不复制）
+    调用方应传入自己持有的DataFrame（例如列筛选后的结果）
+    
+    :param df: 包含所有Greeks的DataFrame
+    :param spot_price: 当前标的价格
+    :param price_change_pct: 价格变动百分比（如+2表示+2%）
+    :param iv_change_pct: IV变动百分比（如-3表示-3%）
+    :return: 添加了PnL归因列的DataFrame（即传入的df）
+    """
+    for col, values in calculate_pnl_components(df, spot_price, price_change_pct, iv_change_pct).items():
+        df[col] = values
+    
+    return df
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _compute_pnl_cached(snapshot_key: str, spot_price: float, price_change_pct: float,
+                        iv_change_pct: float, _df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """
+    按 (快照键, 标的价格, 价格变动, IV变动) 缓存PnL归因分量
+    滑杆停在已计算过的取值上时直接命中缓存
+    
+    :param snapshot_key: 快照键（_df 本身不参与哈希）
+    :param spot_price: 当前标的价格
+    :param price_change_pct: 价格变动百分比（已按0.5%量化）
+    :param iv_change_pct: IV变动百分比（已按0.5%量化）
+    :param _df: 包含所有Greeks的DataFrame（使用_前缀避免缓存哈希）
+    :return: {PnL列名: ndarray}
+    """
+    return calculate_pnl_components(_df, spot_price, price_change_pct, iv_change_pct)
+
+
+def _attach_scenario_pnl(plot_df: pd.DataFrame, soa: ChainSoA, spot_price: float,
+                         price_change_pct: float, iv_change_pct: float) -> pd.DataFrame:
+    """
+    给按 soa.rows 取出的DataFrame添加PnL归因列（有快照键时按快照和情景缓存，模块2和模块4共用）
+    
+    :param plot_df: 按 soa.rows 取出的DataFrame（调用方持有，直接在其上添加列）
+    :param soa: 快照SoA
+    :param spot_price: 当前标的价格
+    :param price_change_pct: 价格变动百分比
+    :param iv_change_pct: IV变动百分比
+    :return: 添加了PnL归因列的DataFrame（即传入的plot_df）
+    """
+    if not soa.key:
+        return calculate_full_pnl(plot_df, spot_price, price_change_pct, iv_change_pct)
+    
+    # 滑杆步长为0.5%，按0.5%量化后作为缓存键
+    price_change_pct = round(price_change_pct * 2) / 2
+    iv_change_pct = round(iv_change_pct * 2) / 2
+    pnl_components = _compute_pnl_cached(soa.key, spot_price, price_change_pct, iv_change_pct, plot_df)
+    for col, values in pnl_components.items():
+        plot_df[col] = values
+    return plot_df
 
 
 def render_iv_vega_heatmap(df: pd.DataFrame, spot_price: float):
@@ -380,12 +664,13 @@ def render_iv_vega_heatmap(df: pd.DataFrame, spot_price: float):
         return
     
     # 准备实际合约数据
-    required_cols = ['mark_iv', 'delta', 'gamma', 'vega', 'volga', 'vanna', 
+    required_cols = ['mark_iv', 'mark_iv_decimal', 'delta', 'gamma', 'vega', 'volga', 'vanna', 
                      'instrument_name', 'strike', 'option_type', 'expiration_date']
     available_cols = [col for col in required_cols if col in df.columns]
     
-    plot_df = df[available_cols].copy()
-    plot_df = plot_df.dropna(subset=required_greeks)
+    # Greeks完整的行已在快照SoA中确定，直接按位置取出，不再重复构建NaN掩码
+    soa = get_chain_soa(df)
+    plot_df = df[available_cols].take(soa.rows)
     
     if plot_df.empty:
         st.warning("没有有效的Greeks数据")
@@ -442,39 +727,34 @@ def render_iv_vega_heatmap(df: pd.DataFrame, spot_price: float):
                    "总PnL = 波动率贡献（Vega + Volga）+ 交互贡献（Vanna）。"
                    "调整价格变动滑杆可以观察价格变化对PnL的影响。")
     
-    # 使用完整泰勒展开计算PnL
-    plot_df = calculate_full_pnl(plot_df, spot_price, price_change_pct, iv_change_pct)
+    # 使用完整泰勒展开计算PnL（按快照和情景缓存）
+    plot_df = _attach_scenario_pnl(plot_df, soa, spot_price, price_change_pct, iv_change_pct)
     
     # 根据视图模式显示不同图表
     if view_mode == "热力图视图":
-        _render_heatmap_view(plot_df, spot_price, price_change_pct, iv_change_pct)
+        _render_heatmap_view(plot_df, soa, spot_price, price_change_pct, iv_change_pct)
     else:
-        _render_scatter_view(plot_df, spot_price, price_change_pct, iv_change_pct)
+        _render_scatter_view(plot_df, soa, spot_price, price_change_pct, iv_change_pct)
     
     # 显示最佳组合推荐和Top 10列表（两种视图都显示）
     _render_best_combinations(plot_df)
 
 
-def _render_heatmap_view(plot_df: pd.DataFrame, spot_price: float, price_change_pct: float, iv_change_pct: float):
+def _render_heatmap_view(plot_df: pd.DataFrame, soa: ChainSoA, spot_price: float,
+                      price_change_pct: float, iv_change_pct: float):
     """
     渲染热力图视图：IV区间 × Vega区间的收益热力图
     
     :param plot_df: 包含PnL数据的DataFrame
+    :param soa: 快照SoA（行与plot_df一一对应）
     :param spot_price: 当前标的价格
     :param price_change_pct: 价格变动百分比
     :param iv_change_pct: IV变动百分比
     """
     st.subheader("📊 热力图视图：IV-Vega收益热力图")
     
-    # 准备IV显示格式
-    if 'mark_iv_decimal' in plot_df.columns:
-        iv_display = plot_df['mark_iv_decimal'] * 100
-    else:
-        iv_max = plot_df['mark_iv'].max()
-        if iv_max > 1.0:
-            iv_display = plot_df['mark_iv']
-        else:
-            iv_display = plot_df['mark_iv'] * 100
+    # IV显示格式（mark_iv_decimal 由 prepare_volga_data 统一生成）
+    iv_display = soa.mark_iv_decimal * 100
     
     # 设置区间数量
     num_bins = st.slider(
@@ -487,24 +767,25 @@ def _render_heatmap_view(plot_df: pd.DataFrame, spot_price: float, price_change_
     )
     
     # 创建IV和Vega区间
+    vega = soa.vega
     iv_min, iv_max = iv_display.min(), iv_display.max()
-    vega_min, vega_max = plot_df['vega'].min(), plot_df['vega'].max()
+    vega_min, vega_max = vega.min(), vega.max()
     
     # 确保区间范围合理
     iv_bins = np.linspace(iv_min, iv_max, num_bins + 1)
     vega_bins = np.linspace(vega_min, vega_max, num_bins + 1)
     
-    # 将数据分配到区间
-    plot_df['iv_bin'] = pd.cut(iv_display, bins=iv_bins, include_lowest=True, labels=False)
-    plot_df['vega_bin'] = pd.cut(plot_df['vega'], bins=vega_bins, include_lowest=True, labels=False)
-    
-    # 计算每个区间的平均PnL
-    heatmap_data = plot_df.groupby(['iv_bin', 'vega_bin'])['pnl_total'].mean().reset_index()
-    heatmap_pivot = heatmap_data.pivot(index='vega_bin', columns='iv_bin', values='pnl_total')
+    # 计算每个区间的平均PnL：加权直方图得到PnL总和，普通直方图得到合约数，相除即均值
+    # 行 = Vega区间，列 = IV区间；没有数据的区间为NaN
+    pnl_sum, _, _ = np.histogram2d(vega, iv_display, bins=[vega_bins, iv_bins],
+                                   weights=plot_df['pnl_total'].to_numpy())
+    counts, _, _ = np.histogram2d(vega, iv_display, bins=[vega_bins, iv_bins])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        heatmap_values = pnl_sum / counts
     
     # 统计空区间数量（用于说明）
-    total_cells = heatmap_pivot.size
-    empty_cells = heatmap_pivot.isna().sum().sum()
+    total_cells = heatmap_values.size
+    empty_cells = int((counts == 0).sum())
     filled_cells = total_cells - empty_cells
     empty_pct = empty_cells / total_cells * 100 if total_cells > 0 else 0
     
@@ -519,13 +800,13 @@ def _render_heatmap_view(plot_df: pd.DataFrame, spot_price: float, price_change_
     
     # 创建热力图（NaN值会被Plotly自动处理为空白）
     fig = go.Figure(data=go.Heatmap(
-        z=heatmap_pivot.values,
+        z=heatmap_values,
         x=[f"{iv_bins[i]:.1f}-{iv_bins[i+1]:.1f}%" for i in range(len(iv_bins)-1)],
         y=[f"{vega_bins[i]:.2f}-{vega_bins[i+1]:.2f}" for i in range(len(vega_bins)-1)],
         colorscale='RdYlGn',
         colorbar=dict(title="平均总PnL"),
         hovertemplate='IV区间: %{x}<br>Vega区间: %{y}<br>平均PnL: %{z:.2f}<extra></extra>',
-        text=heatmap_pivot.values.round(2),
+        text=np.round(heatmap_values, 2),
         texttemplate='%{text}',
         textfont={"size": 8},
         zmid=0  # 设置颜色中点，使0值显示为中性色
@@ -546,94 +827,57 @@ def _render_heatmap_view(plot_df: pd.DataFrame, spot_price: float, price_change_
               f"**数据覆盖**：{filled_cells}/{total_cells} 区间有数据（{100-empty_pct:.1f}%），空白区域表示该IV-Vega组合在当前期权链中不存在。")
 
 
-def _render_scatter_view(plot_df: pd.DataFrame, spot_price: float, price_change_pct: float, iv_change_pct: float):
+def _build_scatter_figure(iv_display: np.ndarray, vega: np.ndarray, pnl_total: np.ndarray,
+                          hover_text: pd.Series, stars: List[tuple], title: str) -> go.Figure:
     """
-    渲染散点图视图：所有实际合约的IV-Vega散点图（带PnL颜色）
-    
-    :param plot_df: 包含PnL数据的DataFrame
-    :param spot_price: 当前标的价格
-    :param price_change_pct: 价格变动百分比
-    :param iv_change_pct: IV变动百分比
+    构建散点图视图的Figure（每次重跑按当前情景重新构建）
+    
+    :param iv_display: IV（百分比）数组
+    :param vega: Vega数组
+    :param pnl_total: 总PnL数组（散点颜色）
+    :param hover_text: 散点悬停文本
+    :param stars: 星标列表 [(名称, 颜色, 边框颜色, x, y, 悬停模板), ...]
+    :param title: 图表标题
+    :return: Plotly Figure
     """
-    st.subheader("📊 散点图视图：IV-Vega收益散点图")
-    
-    # 准备IV显示格式
-    if 'mark_iv_decimal' in plot_df.columns:
-        iv_display = plot_df['mark_iv_decimal'] * 100
-    else:
-        iv_max = plot_df['mark_iv'].max()
-        if iv_max > 1.0:
-            iv_display = plot_df['mark_iv']
-        else:
-            iv_display = plot_df['mark_iv'] * 100
-    
-    # 找出最佳组合（基于总PnL）
-    best_buy = plot_df.loc[plot_df['pnl_total'].idxmax()]  # 买入：PnL最高
-    best_sell = plot_df.loc[plot_df['pnl_total'].idxmin()]  # 卖出：PnL最低（负值最大）
-    
-    # 创建散点图：显示所有实际合约（颜色=总PnL）
     fig = go.Figure()
     
-    # 添加所有合约的散点
+    # 所有合约的散点（颜色=总PnL）
     fig.add_trace(go.Scatter(
         x=iv_display,
-        y=plot_df['vega'],
+        y=vega,
         mode='markers',
         marker=dict(
             size=8,
-            color=plot_df['pnl_total'],
+            color=pnl_total,
             colorscale='RdYlGn',
             showscale=True,
             colorbar=dict(title="总PnL"),
             line=dict(width=1, color='gray')
         ),
-        text=plot_df.apply(lambda row: f"{safe_get_instrument_name(row)}<br>"
-                                       f"行权价: {row.get('strike', 0):.0f}<br>"
-                                       f"类型: {row.get('option_type', 'N/A')}<br>"
-                                       f"IV: {iv_display.iloc[plot_df.index.get_loc(row.name)]:.2f}%<br>"
-                                       f"Vega: {row['vega']:.2f}<br>"
-                                       f"总PnL: {row['pnl_total']:.2f}<br>"
-                                       f"  - 价格: {row['pnl_price_total']:.2f}<br>"
-                                       f"  - 波动率: {row['pnl_vol_total']:.2f} (Volga: {row['pnl_vol_volga']:.2f})<br>"
-                                       f"  - 交互: {row['pnl_interaction']:.2f}", axis=1),
+        text=hover_text,
         hovertemplate='%{text}<extra></extra>',
         name='所有合约'
     ))
     
-    # 高亮最佳买入合约
-    best_buy_iv = iv_display.iloc[plot_df.index.get_loc(best_buy.name)]
-    fig.add_trace(go.Scatter(
-        x=[best_buy_iv],
-        y=[best_buy['vega']],
-        mode='markers',
-        marker=dict(
-            size=20,
-            symbol='star',
-            color='green',
-            line=dict(width=2, color='darkgreen')
-        ),
-        name='最佳买入',
-        hovertemplate=f"最佳买入合约<br>{safe_get_instrument_name(best_buy)}<br>总PnL: {best_buy['pnl_total']:.2f}<extra></extra>"
-    ))
-    
-    # 高亮最佳卖出合约
-    best_sell_iv = iv_display.iloc[plot_df.index.get_loc(best_sell.name)]
-    fig.add_trace(go.Scatter(
-        x=[best_sell_iv],
-        y=[best_sell['vega']],
-        mode='markers',
-        marker=dict(
-            size=20,
-            symbol='star',
-            color='red',
-            line=dict(width=2, color='darkred')
-        ),
-        name='最佳卖出',
-        hovertemplate=f"最佳卖出合约<br>{safe_get_instrument_name(best_sell)}<br>总PnL: {best_sell['pnl_total']:.2f}<extra></extra>"
-    ))
+    # 最佳买入/卖出合约星标
+    for name, color, line_color, x, y, hovertemplate in stars:
+        fig.add_trace(go.Scatter(
+            x=[x],
+            y=[y],
+            mode='markers',
+            marker=dict(
+                size=20,
+                symbol='star',
+                color=color,
+                line=dict(width=2, color=line_color)
+            ),
+            name=name,
+            hovertemplate=hovertemplate
+        ))
     
     fig.update_layout(
-        title=f'IV-Vega收益散点图（价格{price_change_pct:+.1f}%, IV{iv_change_pct:+.1f}%）- 基于完整泰勒展开',
+        title=title,
         xaxis_title='IV (%)',
         yaxis_title='Vega',
         height=600,
@@ -642,6 +886,57 @@ def _render_scatter_view(plot_df: pd.DataFrame, spot_price: float, price_change_
         legend=dict(yanchor="top", y=0.99, xanchor="left", x=0.01)
     )
     
+    return fig
+
+
+def _render_scatter_view(plot_df: pd.DataFrame, soa: ChainSoA, spot_price: float,
+                      price_change_pct: float, iv_change_pct: float):
+    """
+    渲染散点图视图：所有实际合约的IV-Vega散点图（带PnL颜色）
+    
+    :param plot_df: 包含PnL数据的DataFrame
+    :param soa: 快照SoA（行与plot_df一一对应）
+    :param spot_price: 当前标的价格
+    :param price_change_pct: 价格变动百分比
+    :param iv_change_pct: IV变动百分比
+    """
+    st.subheader("📊 散点图视图：IV-Vega收益散点图")
+    
+    # IV显示格式（mark_iv_decimal 由 prepare_volga_data 统一生成）
+    iv_display = soa.mark_iv_decimal * 100
+    
+    # 找出最佳组合（基于总PnL，按位置索引，便于与iv_display对齐）
+    pnl_total = plot_df['pnl_total'].to_numpy()
+    best_buy_pos = int(np.nanargmax(pnl_total))  # 买入：PnL最高
+    best_sell_pos = int(np.nanargmin(pnl_total))  # 卖出：PnL最低（负值最大）
+    best_buy = plot_df.iloc[best_buy_pos]
+    best_sell = plot_df.iloc[best_sell_pos]
+    
+    # 悬停文本（按列向量化拼接；SoA字段与plot_df按位置一一对应）
+    hover_text = (pd.Series(soa.name, index=plot_df.index) +
+                  '<br>行权价: ' + np.char.mod('%.0f', soa.strike) +
+                  '<br>类型: ' + soa.option_type +
+                  '<br>IV: ' + np.char.mod('%.2f', iv_display) + '%' +
+                  '<br>Vega: ' + format_numbers(plot_df['vega'], '%.2f') +
+                  '<br>总PnL: ' + format_numbers(plot_df['pnl_total'], '%.2f') +
+                  '<br>  - 价格: ' + format_numbers(plot_df['pnl_price_total'], '%.2f') +
+                  '<br>  - 波动率: ' + format_numbers(plot_df['pnl_vol_total'], '%.2f') +
+                  ' (Volga: ' + format_numbers(plot_df['pnl_vol_volga'], '%.2f') + ')' +
+                  '<br>  - 交互: ' + format_numbers(plot_df['pnl_interaction'], '%.2f'))
+    
+    # 高亮最佳买入/卖出合约
+    stars = [
+        ('最佳买入', 'green', 'darkgreen', iv_display[best_buy_pos], best_buy['vega'],
+         f"最佳买入合约<br>{safe_get_instrument_name(best_buy)}<br>总PnL: {best_buy['pnl_total']:.2f}<extra></extra>"),
+        ('最佳卖出', 'red', 'darkred', iv_display[best_sell_pos], best_sell['vega'],
+         f"最佳卖出合约<br>{safe_get_instrument_name(best_sell)}<br>总PnL: {best_sell['pnl_total']:.2f}<extra></extra>")
+    ]
+    
+    fig = _build_scatter_figure(
+        iv_display, soa.vega, pnl_total, hover_text, stars,
+        f'IV-Vega收益散点图（价格{price_change_pct:+.1f}%, IV{iv_change_pct:+.1f}%）- 基于完整泰勒展开'
+    )
+    
     st.plotly_chart(fig, width='stretch')
     
     st.caption("💡 **解读指南**：每个点代表一个实际合约，颜色表示总PnL（暖色=收益，冷色=损失）。"
@@ -654,9 +949,12 @@ def _render_best_combinations(plot_df: pd.DataFrame):
     
     :param plot_df: 包含PnL数据的DataFrame
     """
+    pnl_total = plot_df['pnl_total'].to_numpy()
+    pnl_max, pnl_min = np.nanmax(pnl_total), np.nanmin(pnl_total)
+    
     # 检查是否所有PnL都接近0（说明没有价格或IV变动）
-    pnl_range = plot_df['pnl_total'].max() - plot_df['pnl_total'].min()
-    max_abs_pnl = max(abs(plot_df['pnl_total'].max()), abs(plot_df['pnl_total'].min()))
+    pnl_range = pnl_max - pnl_min
+    max_abs_pnl = max(abs(pnl_max), abs(pnl_min))
     
     if pnl_range < 0.01 and max_abs_pnl < 0.01:
         st.warning("⚠️ **注意**：当前所有合约的PnL都接近0，无法推荐最佳组合。\n\n"
@@ -667,9 +965,11 @@ def _render_best_combinations(plot_df: pd.DataFrame):
                   "3. 设定有意义的市场情景后，最佳组合推荐才会有价值")
         return
     
-    # 找出最佳组合（基于总PnL）
-    best_buy = plot_df.loc[plot_df['pnl_total'].idxmax()]  # 买入：PnL最高
-    best_sell = plot_df.loc[plot_df['pnl_total'].idxmin()]  # 卖出：PnL最低（负值最大）
+    # Top 10（部分选择，不对整列排序）；第一名即最佳组合
+    top_buy_pos = top_k_positions(pnl_total, 10, largest=True)
+    top_sell_pos = top_k_positions(pnl_total, 10, largest=False)
+    best_buy = plot_df.iloc[top_buy_pos[0]]  # 买入：PnL最高
+    best_sell = plot_df.iloc[top_sell_pos[0]]  # 卖出：PnL最低（负值最大）
     
     # 显示最佳组合推荐
     st.subheader("🎯 最佳组合推荐（基于当前情景）")
@@ -704,7 +1004,7 @@ def _render_best_combinations(plot_df: pd.DataFrame):
     
     # 显示Top 10最佳组合（带归因分析）
     st.subheader("📊 Top 10 最佳买入合约（总PnL从高到低，带归因分析）")
-    top_buy = plot_df.nlargest(10, 'pnl_total')[
+    top_buy = plot_df.iloc[top_buy_pos][
         ['instrument_name', 'strike', 'option_type', 'pnl_total', 
          'pnl_price_total', 'pnl_vol_total', 'pnl_vol_volga', 'pnl_interaction']
     ].copy()
@@ -717,7 +1017,7 @@ def _render_best_combinations(plot_df: pd.DataFrame):
     st.caption("💡 **归因解读**：查看每个合约的PnL来源。如果'Volga贡献'很大，说明该合约的收益主要来自Volga凸性，而非简单的Vega线性效应。")
     
     st.subheader("📊 Top 10 最佳卖出合约（总PnL从低到高，适合做空）")
-    top_sell = plot_df.nsmallest(10, 'pnl_total')[
+    top_sell = plot_df.iloc[top_sell_pos][
         ['instrument_name', 'strike', 'option_type', 'pnl_total',
          'pnl_price_total', 'pnl_vol_total', 'pnl_vol_volga', 'pnl_interaction']
     ].copy()
@@ -728,6 +1028,57 @@ def _render_best_combinations(plot_df: pd.DataFrame):
     st.dataframe(top_sell_display, width='stretch')
 
 
+def _build_loss_figure(iv_changes: np.ndarray, linear_pnl: np.ndarray, full_pnl: np.ndarray,
+                       title: str) -> go.Figure:
+    """
+    构建Volga损耗计算器的PnL曲线图
+    
+    :param iv_changes: IV变动（%）数组
+    :param linear_pnl: 线性PnL数组
+    :param full_pnl: 完整PnL数组
+    :param title: 图表标题
+    :return: Plotly Figure
+    """
+    # 创建图表
+    fig = go.Figure()
+    
+    # 线性PnL线
+    fig.add_trace(go.Scatter(
+        x=iv_changes,
+        y=linear_pnl,
+        mode='lines',
+        name='线性PnL（一阶Greeks）',
+        line=dict(color='blue', width=2),
+        hovertemplate='IV变动: %{x:.2f}%<br>PnL: %{y:.2f}<extra></extra>'
+    ))
+    
+    # 完整PnL线
+    fig.add_trace(go.Scatter(
+        x=iv_changes,
+        y=full_pnl,
+        mode='lines',
+        name='完整PnL（包含Volga/Vanna/Gamma）',
+        line=dict(color='red', width=2),
+        hovertemplate='IV变动: %{x:.2f}%<br>PnL: %{y:.2f}<extra></extra>'
+    ))
+    
+    # 零线
+    fig.add_hline(y=0, line_dash="dot", line_color="gray", opacity=0.5)
+    fig.add_vline(x=0, line_dash="dot", line_color="gray", opacity=0.5)
+    
+    fig.update_layout(
+        title=title,
+        xaxis_title='IV变动 (%)',
+        yaxis_title='PnL',
+        height=500,
+        template='plotly_white',
+        hovermode='x unified',
+        legend=dict(yanchor="top", y=0.99, xanchor="left", x=0.01)
+    )
+    
+    return fig
+
+
 def render_volga_loss_calculator(df: pd.DataFrame, spot_price: float):
     """
     模块3：Volga损耗计算器（具体数值）
@@ -765,60 +1116,35 @@ def render_volga_loss_calculator(df: pd.DataFrame, spot_price: float):
         st.warning("没有有效数据")
         return
     
-    # 准备合约列表
-    required_cols = ['instrument_name', 'strike', 'option_type', 'expiration_date', 
-                     'delta', 'gamma', 'vega', 'volga', 'vanna', 'mark_iv']
-    available_cols = [col for col in required_cols if col in df.columns]
-    
-    contract_df = df[available_cols].copy()
-    contract_df = contract_df.dropna(subset=required_greeks)
+    # 合约列表和显示名称直接读取快照SoA（每个快照只构建一次）
+    soa = get_chain_soa(df)
     
-    if contract_df.empty:
+    if len(soa.label) == 0:
         st.warning("没有有效的合约数据")
         return
     
-    # 创建显示名称（使用apply避免Series格式化问题）
-    def format_contract_name(row):
-        inst_name = safe_get_instrument_name(row)
-        strike = float(row.get('strike', 0))
-        opt_type = str(row.get('option_type', '?'))
-        vega_val = float(row.get('vega', 0))
-        volga_val = float(row.get('volga', 0))
-        exp_date = str(row.get('expiration_date', ''))[:10] if 'expiration_date' in row else ''
-        
-        # 简化显示：只显示关键信息
-        return f"{inst_name} | 行权价:{strike:.0f} | {opt_type} | Vega:{vega_val:.2f} | Volga:{volga_val:.2f}"
-    
-    contract_df['display_name'] = contract_df.apply(format_contract_name, axis=1)
-    
     # 合约选择器
-    if len(contract_df) > 0:
-        selected_idx = st.selectbox(
-            "选择合约（用于Volga损耗分析）",
-            options=range(len(contract_df)),
-            format_func=lambda x: contract_df.iloc[x]['display_name'] if 0 <= x < len(contract_df) else "无效索引"
-        )
-        
-        # 安全获取选中的合约
-        if 0 <= selected_idx < len(contract_df):
-            selected_contract = contract_df.iloc[selected_idx]
-        else:
-            st.error("选择的合约索引无效")
-            return
-    else:
-        st.warning("没有可用的合约数据")
+    selected_idx = st.selectbox(
+        "选择合约（用于Volga损耗分析）",
+        options=range(len(soa.label)),
+        format_func=lambda x: soa.label[x] if 0 <= x < len(soa.label) else "无效索引"
+    )
+    
+    # 安全获取选中的合约
+    if not 0 <= selected_idx < len(soa.label):
+        st.error("选择的合约索引无效")
         return
     
     # 显示选中合约信息
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Vega", f"{selected_contract['vega']:.2f}")
+        st.metric("Vega", f"{soa.vega[selected_idx]:.2f}")
     with col2:
-        st.metric("Volga", f"{selected_contract['volga']:.2f}")
+        st.metric("Volga", f"{soa.volga[selected_idx]:.2f}")
     with col3:
-        st.metric("当前IV", f"{selected_contract['mark_iv']:.2%}")
+        st.metric("当前IV", f"{soa.mark_iv_decimal[selected_idx]:.2%}")
     with col4:
-        st.metric("行权价", f"{selected_contract['strike']:.0f}")
+        st.metric("行权价", f"{soa.strike[selected_idx]:.0f}")
     
     # 情景控制：价格和IV变动
     st.write("**情景设置**")
@@ -862,111 +1188,65 @@ def render_volga_loss_calculator(df: pd.DataFrame, spot_price: float):
     iv_changes = np.linspace(iv_change_min, iv_change_max, num_points)
     
     # 获取合约Greeks
-    delta = selected_contract['delta']
-    gamma = selected_contract['gamma']
-    vega = selected_contract['vega']
-    volga = selected_contract['volga']
-    vanna = selected_contract['vanna']
+    delta = float(soa.delta[selected_idx])
+    gamma = float(soa.gamma[selected_idx])
+    vega = float(soa.vega[selected_idx])
+    volga = float(soa.volga[selected_idx])
+    vanna = float(soa.vanna[selected_idx])
     
     # 价格变动（绝对）
     dS = spot_price * price_change_pct / 100.0
     
-    # 线性PnL（只考虑一阶Greeks）
-    # PnL = Delta × dS + Vega × dVol
-    linear_pnl = delta * dS + vega * (iv_changes / 100.0) * 100  # 转换为百分比显示
-    
-    # 完整PnL（包含所有Greeks）
-    # PnL = Delta×dS + ½×Gamma×(dS)² + Vega×dVol + ½×Volga×(dVol)² + Vanna×dS×dVol
+    # 合约固定后三条曲线都是dVol的二次多项式：系数按列组成矩阵（行依次为 dVol²、dVol、常数项），
+    # 与范德蒙德矩阵 [dVol², dVol, 1] 做一次矩阵乘法，单次遍历得到全部曲线
     dVol = iv_changes / 100.0
-    full_pnl = (delta * dS + 
-                0.5 * gamma * dS * dS +
-                vega * dVol * 100 +
-                0.5 * volga * dVol * dVol * 100 +
-                vanna * dS * dVol * 100)
-    
-    # 凸性贡献 = 完整PnL - 线性PnL
-    convexity_contribution = full_pnl - linear_pnl
-    
-    # 创建图表
-    fig = go.Figure()
-    
-    # 线性PnL线
-    fig.add_trace(go.Scatter(
-        x=iv_changes,
-        y=linear_pnl,
-        mode='lines',
-        name='线性PnL（一阶Greeks）',
-        line=dict(color='blue', width=2),
-        hovertemplate='IV变动: %{x:.2f}%<br>PnL: %{y:.2f}<extra></extra>'
-    ))
-    
-    # 完整PnL线
-    fig.add_trace(go.Scatter(
-        x=iv_changes,
-        y=full_pnl,
-        mode='lines',
-        name='完整PnL（包含Volga/Vanna/Gamma）',
-        line=dict(color='red', width=2),
-        hovertemplate='IV变动: %{x:.2f}%<br>PnL: %{y:.2f}<extra></extra>'
-    ))
-    
-    # 零线
-    fig.add_hline(y=0, line_dash="dot", line_color="gray", opacity=0.5)
-    fig.add_vline(x=0, line_dash="dot", line_color="gray", opacity=0.5)
-    
-    # 安全获取合约名称
-    contract_name = selected_contract.get('instrument_name', 'N/A')
-    if contract_name is None or contract_name == '':
-        contract_name = f"{selected_contract.get('option_type', '?')} {selected_contract.get('strike', 0):.0f}"
-    
-    fig.update_layout(
-        title=f'凸性分析：{contract_name}（价格{price_change_pct:+.1f}%）',
-        xaxis_title='IV变动 (%)',
-        yaxis_title='PnL',
-        height=500,
-        template='plotly_white',
-        hovermode='x unified',
-        legend=dict(yanchor="top", y=0.99, xanchor="left", x=0.01)
-    )
+    price_pnl = delta * dS
+    gamma_pnl = 0.5 * gamma * dS * dS
+    volga_coef = 0.5 * volga * 100
+    vanna_coef = vanna * dS * 100
+    
+    # 列：线性PnL（Delta × dS + Vega × dVol，只考虑一阶Greeks）、
+    #     完整PnL（Delta×dS + ½×Gamma×(dS)² + Vega×dVol + ½×Volga×(dVol)² + Vanna×dS×dVol）、
+    #     凸性贡献（完整PnL - 线性PnL）；Vega等项 ×100 转换为百分比显示
+    coeffs = np.array([
+        [0.0, volga_coef, volga_coef],
+        [vega * 100, vega * 100 + vanna_coef, vanna_coef],
+        [price_pnl, price_pnl + gamma_pnl, gamma_pnl]
+    ])
+    linear_pnl, full_pnl, convexity_contribution = (np.vander(dVol, 3) @ coeffs).T
+    
+    # 曲线图只由合约和情景参数决定：参数不变的重跑（如其他模块的控件交互）直接复用 session_state 中的Figure
+    fig_key = (soa.key, selected_idx, price_change_pct, iv_change_min, iv_change_max, num_points)
+    if soa.key and st.session_state.get('loss_fig_key') == fig_key:
+        fig = st.session_state['loss_fig']
+    else:
+        # 合约名称（缺失时已回退为"类型-行权价"）
+        contract_name = soa.name[selected_idx]
+        fig = _build_loss_figure(iv_changes, linear_pnl, full_pnl,
+                                 f'凸性分析：{contract_name}（价格{price_change_pct:+.1f}%）')
+        if soa.key:
+            st.session_state['loss_fig'] = fig
+            st.session_state['loss_fig_key'] = fig_key
     
     st.plotly_chart(fig, width='stretch')
     
-    # 显示归因统计
+    # 显示归因统计（统计量只计算一次；最大值直接由argmax位置取值，不再单独遍历）
     st.write("**凸性贡献统计**")
-    col1, col2, col3, col4 = st.columns(4)
-    with col1:
-        if len(convexity_contribution) > 0:
-            max_contrib = convexity_contribution.max()
-            max_idx = np.argmax(convexity_contribution)
-            if max_idx < len(iv_changes):
-                st.metric("最大凸性贡献", f"{max_contrib:.2f}", 
-                         delta=f"IV变动 {iv_changes[max_idx]:+.1f}%")
-            else:
-                st.metric("最大凸性贡献", f"{max_contrib:.2f}")
-        else:
-            st.metric("最大凸性贡献", "N/A")
-    with col2:
-        if len(convexity_contribution) > 0:
-            min_contrib = convexity_contribution.min()
-            st.metric("最小凸性贡献", f"{min_contrib:.2f}")
-        else:
-            st.metric("最小凸性贡献", "N/A")
-    with col3:
-        if len(convexity_contribution) > 0:
-            avg_contrib = convexity_contribution.mean()
-            st.metric("平均凸性贡献", f"{avg_contrib:.2f}")
-        else:
-            st.metric("平均凸性贡献", "N/A")
-    with col4:
-        if len(iv_changes) > 0 and len(convexity_contribution) > 0:
-            target_idx = np.abs(iv_changes - -3.0).argmin()
-            if target_idx < len(convexity_contribution):
-                contrib_at_target = convexity_contribution[target_idx]
-                st.metric("IV降3%时贡献", f"{contrib_at_target:.2f}")
-            else:
-                st.metric("IV降3%时贡献", "N/A")
-        else:
-            st.metric("IV降3%时贡献", "N/A")
+    # 四个指标整理为 (标签, 数值, delta) 列表，统一渲染
+    if len(convexity_contribution) > 0:
+        max_idx = int(np.argmax(convexity_contribution))
+        target_idx = int(np.abs(iv_changes - -3.0).argmin())
+        metrics = [
+            ("最大凸性贡献", f"{convexity_contribution[max_idx]:.2f}", f"IV变动 {iv_changes[max_idx]:+.1f}%"),
+            ("最小凸性贡献", f"{convexity_contribution.min():.2f}", None),
+            ("平均凸性贡献", f"{convexity_contribution.mean():.2f}", None),
+            ("IV降3%时贡献", f"{convexity_contribution[target_idx]:.2f}", None)
+        ]
+    else:
+        metrics = [(label, "N/A", None) for label in ("最大凸性贡献", "最小凸性贡献", "平均凸性贡献", "IV降3%时贡献")]
+    
+    for col, (label, value, delta_text) in zip(st.columns(4), metrics):
+        col.metric(label, value, delta=delta_text)
     
     # 显示Greeks值
     st.write("**当前合约Greeks值**")
@@ -1148,229 +1428,206 @@ def render_volga_analysis_view(db: OptionsDatabase):
         st.dataframe(volga_df[available_cols], width='stretch')
 
 
-def scan_long_vol_convexity_strategies(df: pd.DataFrame, spot_price: float, 
-                                       price_change_pct: float, iv_change_pct: float,
+def _combine_greeks(first_leg, second_leg, second_sign: int = 1) -> Dict[str, float]:
+    """
+    两腿组合的Greeks：Greeks对数量线性可加，直接按腿的方向相加，无需重新定价
+    
+    :param first_leg: 第一条腿（数量+1）的Greeks（Series、namedtuple字段或字典均可按名称取值）
+    :param second_leg: 第二条腿的Greeks
+    :param second_sign: 第二条腿的数量（+1买入，-1卖出）
+    :return: 组合Greeks字典
+    """
+    return {g: float(first_leg[g] + second_sign * second_leg[g]) for g in _GREEK_COLUMNS}
+
+
+def scan_long_vol_convexity_strategies(plot_df: pd.DataFrame, spot_price: float,
                                        min_volga: float = 0.0, max_vega: float = 1000.0,
                                        max_iv_percentile: float = 80.0) -> List[Dict]:
     """
     扫描做多波动率凸性策略（Long Vol Convexity）
     寻找Volga>0且Vega相对合理的Long Straddle/Strangle组合
     
-    :param df: 包含所有Greeks的数据
+    :param plot_df: 包含所有Greeks和PnL归因列的数据（由调用方计算一次，多个扫描器共用）
     :param spot_price: 当前标的价格
-    :param price_change_pct: 价格变动百分比
-    :param iv_change_pct: IV变动百分比
     :param min_volga: 最小Volga阈值
     :param max_vega: 最大Vega阈值
     :param max_iv_percentile: 最大IV百分位（避免高估）
     :return: 推荐策略列表
     """
-    strategies = []
+    # 筛选符合条件的合约（条件逐行独立，整条链一次完成）
+    iv_percentile = plot_df['iv_percentile'] if 'iv_percentile' in plot_df.columns else 50.0
+    candidates = plot_df[
+        (plot_df['volga'] > min_volga) &
+        (plot_df['vega'] <= max_vega) &
+        (plot_df['vega'] > 0) &
+        (iv_percentile <= max_iv_percentile)
+    ]
+    
+    if len(candidates) < 2:
+        return []
+    
+    # 配对所需的腿信息（同一到期日、同一行权价、同一类型只取第一个合约）
+    legs = pd.DataFrame({
+        'expiration_date': candidates['expiration_date'],
+        'strike': candidates['strike'],
+        'instrument': safe_get_instrument_names(candidates),
+        **{g: candidates[g] for g in _GREEK_COLUMNS},
+        'pnl_total': candidates['pnl_total'],
+        'pnl_vol_total': candidates['pnl_vol_total'],
+        'pnl_vol_volga': candidates['pnl_vol_volga']
+    })
+    is_call = (candidates['option_type'] == 'C').to_numpy()
+    calls = legs[is_call].drop_duplicates(['expiration_date', 'strike'])
+    puts = legs[~is_call].drop_duplicates(['expiration_date', 'strike'])
+    
+    # Long Straddle：同一到期日、同一ATM行权价（±5%）的Call + Put
+    straddles = calls.merge(puts, on=['expiration_date', 'strike'], suffixes=('_c', '_p'))
+    straddles = straddles[(straddles['strike'] - spot_price).abs() < spot_price * 0.05]
+    straddles = straddles.rename(columns={'strike': 'strike_c'}).assign(
+        strike_p=straddles['strike'], strategy_type='Long Straddle')
+    
+    # Long Strangle：每个到期日最接近ATM的3个OTM Call行权价 × 3个OTM Put行权价
+    # （Call按行权价升序、Put按降序，组内head(3)即为离现价最近的虚值行权价）
+    otm_call_thresh = spot_price * 1.02
+    otm_put_thresh = spot_price * 0.98
+    # 到期日分组只用于组内截取，无需对分组键排序
+    otm_calls = (calls[calls['strike'] > otm_call_thresh].sort_values('strike')
+                 .groupby('expiration_date', sort=False, observed=True).head(3))
+    otm_puts = (puts[puts['strike'] < otm_put_thresh].sort_values('strike', ascending=False)
+                .groupby('expiration_date', sort=False, observed=True).head(3))
+    strangles = otm_calls.merge(otm_puts, on='expiration_date', suffixes=('_c', '_p'))
+    strangles = strangles.assign(strategy_type='Long Strangle')
+    
+    pairs = pd.concat([straddles, strangles], ignore_index=True)
+    if pairs.empty:
+        return []
+    
+    # 组合Greeks = 两腿Greeks之和；评分 = PnL + 组合Volga加权，整体向量化计算，只为前10名构建结果
+    for g in _GREEK_COLUMNS:
+        pairs[g] = pairs[f'{g}_c'] + pairs[f'{g}_p']
+    pairs['combo_pnl'] = pairs['pnl_total_c'] + pairs['pnl_total_p']
+    pairs['score'] = pairs['combo_pnl'] + pairs['volga'] * 10
     
-    # 计算PnL
-    plot_df = calculate_full_pnl(df.copy(), spot_price, price_change_pct, iv_change_pct)
-    
-    # 按到期日分组
-    for exp_date, exp_group in plot_df.groupby('expiration_date'):
-        # 筛选符合条件的合约
-        candidates = exp_group[
-            (exp_group['volga'] > min_volga) &
-            (exp_group['vega'] <= max_vega) &
-            (exp_group['vega'] > 0) &
-            (exp_group.get('iv_percentile', pd.Series([50] * len(exp_group))) <= max_iv_percentile)
-        ].copy()
-        
-        if len(candidates) < 2:
-            continue
-        
-        # 寻找Long Straddle（ATM Call + ATM Put）
-        atm_strikes = candidates[candidates['strike'].abs() - spot_price < spot_price * 0.05]  # ATM范围：±5%
-        
-        for strike in atm_strikes['strike'].unique():
-            call_candidates = candidates[(candidates['strike'] == strike) & (candidates['option_type'] == 'C')]
-            put_candidates = candidates[(candidates['strike'] == strike) & (candidates['option_type'] == 'P')]
-            
-            if len(call_candidates) > 0 and len(put_candidates) > 0:
-                call = call_candidates.iloc[0]
-                put = put_candidates.iloc[0]
-                
-                # 计算组合Greeks和PnL
-                portfolio = PortfolioAnalyzer()
-                portfolio.current_spot_price = spot_price
-                
-                # 添加持仓
-                call_iv = call.get('mark_iv_decimal', call.get('mark_iv', 0.5))
-                if call_iv > 1.0:
-                    call_iv = call_iv / 100.0
-                put_iv = put.get('mark_iv_decimal', put.get('mark_iv', 0.5))
-                if put_iv > 1.0:
-                    put_iv = put_iv / 100.0
-                
-                portfolio.add_position(
-                    expiration_date=str(exp_date)[:10],
-                    strike=strike,
-                    option_type='C',
-                    quantity=1,
-                    volatility=call_iv
-                )
-                portfolio.add_position(
-                    expiration_date=str(exp_date)[:10],
-                    strike=strike,
-                    option_type='P',
-                    quantity=1,
-                    volatility=put_iv
-                )
-                
-                # 计算组合Greeks
-                greeks = portfolio.calculate_portfolio_greeks(spot_price)
-                
-                # 计算组合PnL
-                combo_pnl = call['pnl_total'] + put['pnl_total']
-                
-                strategies.append({
-                    'strategy_type': 'Long Straddle',
-                    'expiration_date': str(exp_date)[:10],
-                    'strike': strike,
-                    'legs': [
-                        {'type': 'C', 'strike': strike, 'quantity': 1, 'instrument': safe_get_instrument_name(call)},
-                        {'type': 'P', 'strike': strike, 'quantity': 1, 'instrument': safe_get_instrument_name(put)}
-                    ],
-                    'greeks': greeks,
-                    'pnl_total': combo_pnl,
-                    'pnl_vol_total': call['pnl_vol_total'] + put['pnl_vol_total'],
-                    'pnl_vol_volga': call['pnl_vol_volga'] + put['pnl_vol_volga'],
-                    'score': combo_pnl + greeks.get('volga', 0) * 10  # 评分：PnL + Volga加权
-                })
-        
-        # 寻找Long Strangle（OTM Call + OTM Put）
-        otm_calls = candidates[(candidates['strike'] > spot_price * 1.02) & (candidates['option_type'] == 'C')]
-        otm_puts = candidates[(candidates['strike'] < spot_price * 0.98) & (candidates['option_type'] == 'P')]
+    strategies = []
+    for _, pair in pairs.nlargest(10, 'score').iterrows():
+        exp_str = str(pair['expiration_date'])[:10]
+        call_strike, put_strike = pair['strike_c'], pair['strike_p']
+        greeks = {g: float(pair[g]) for g in _GREEK_COLUMNS}
+        combo_pnl = pair['combo_pnl']
         
-        for call_strike in otm_calls['strike'].unique()[:3]:  # 限制数量
-            for put_strike in otm_puts['strike'].unique()[:3]:
-                call_candidates = otm_calls[otm_calls['strike'] == call_strike]
-                put_candidates = otm_puts[otm_puts['strike'] == put_strike]
-                
-                if len(call_candidates) > 0 and len(put_candidates) > 0:
-                    call = call_candidates.iloc[0]
-                    put = put_candidates.iloc[0]
-                    
-                    portfolio = PortfolioAnalyzer()
-                    portfolio.current_spot_price = spot_price
-                    
-                    call_iv = call.get('mark_iv_decimal', call.get('mark_iv', 0.5))
-                    if call_iv > 1.0:
-                        call_iv = call_iv / 100.0
-                    put_iv = put.get('mark_iv_decimal', put.get('mark_iv', 0.5))
-                    if put_iv > 1.0:
-                        put_iv = put_iv / 100.0
-                    
-                    portfolio.add_position(str(exp_date)[:10], call_strike, 'C', 1, volatility=call_iv)
-                    portfolio.add_position(str(exp_date)[:10], put_strike, 'P', 1, volatility=put_iv)
-                    
-                    greeks = portfolio.calculate_portfolio_greeks(spot_price)
-                    combo_pnl = call['pnl_total'] + put['pnl_total']
-                    
-                    strategies.append({
-                        'strategy_type': 'Long Strangle',
-                        'expiration_date': str(exp_date)[:10],
-                        'strike': f"{put_strike:.0f}/{call_strike:.0f}",
-                        'legs': [
-                            {'type': 'C', 'strike': call_strike, 'quantity': 1, 'instrument': safe_get_instrument_name(call)},
-                            {'type': 'P', 'strike': put_strike, 'quantity': 1, 'instrument': safe_get_instrument_name(put)}
-                        ],
-                        'greeks': greeks,
-                        'pnl_total': combo_pnl,
-                        'pnl_vol_total': call['pnl_vol_total'] + put['pnl_vol_total'],
-                        'pnl_vol_volga': call['pnl_vol_volga'] + put['pnl_vol_volga'],
-                        'score': combo_pnl + greeks.get('volga', 0) * 10
-                    })
-    
-    # 按评分排序
-    strategies.sort(key=lambda x: x['score'], reverse=True)
-    return strategies[:10]  # 返回Top 10
-
-
-def scan_vol_arbitrage_strategies(df: pd.DataFrame, spot_price: float,
-                                  price_change_pct: float, iv_change_pct: float) -> List[Dict]:
+        strategies.append({
+            'strategy_type': pair['strategy_type'],
+            'expiration_date': exp_str,
+            'strike': call_strike if pair['strategy_type'] == 'Long Straddle' else f"{put_strike:.0f}/{call_strike:.0f}",
+            'legs': [
+                {'type': 'C', 'strike': call_strike, 'quantity': 1, 'instrument': pair['instrument_c']},
+                {'type': 'P', 'strike': put_strike, 'quantity': 1, 'instrument': pair['instrument_p']}
+            ],
+            'greeks': greeks,
+            'pnl_total': combo_pnl,
+            'pnl_vol_total': pair['pnl_vol_total_c'] + pair['pnl_vol_total_p'],
+            'pnl_vol_volga': pair['pnl_vol_volga_c'] + pair['pnl_vol_volga_p'],
+            'score': pair['score']  # 评分：PnL + Volga加权
+        })
+    
+    # pairs.nlargest 已按评分降序返回Top 10
+    return strategies
+
+
+def scan_vol_arbitrage_strategies(plot_df: pd.DataFrame, spot_price: float) -> List[Dict]:
     """
     扫描波动率套利策略
     买入高Volga(被低估) + 卖出低Volga(被高估)的对冲组合
     
-    :param df: 包含所有Greeks的数据
+    :param plot_df: 包含所有Greeks和PnL归因列的数据（由调用方计算一次，多个扫描器共用）
     :param spot_price: 当前标的价格
-    :param price_change_pct: 价格变动百分比
-    :param iv_change_pct: IV变动百分比
     :return: 推荐策略列表
     """
-    strategies = []
-    
-    plot_df = calculate_full_pnl(df.copy(), spot_price, price_change_pct, iv_change_pct)
-    
-    # 按到期日分组
-    for exp_date, exp_group in plot_df.groupby('expiration_date'):
-        # 寻找高Volga低IV（被低估）的合约
-        undervalued = exp_group[
-            (exp_group['volga'] > exp_group['volga'].quantile(0.7)) &
-            (exp_group.get('iv_percentile', pd.Series([50] * len(exp_group))) < 50)
-        ].copy()
-        
-        # 寻找低Volga高IV（被高估）的合约
-        overvalued = exp_group[
-            (exp_group['volga'] < exp_group['volga'].quantile(0.3)) &
-            (exp_group.get('iv_percentile', pd.Series([50] * len(exp_group))) > 50)
-        ].copy()
-        
-        if len(undervalued) == 0 or len(overvalued) == 0:
+    # 各到期日的Volga 30%/70%分位数一次性按组计算，再用布尔掩码整体筛选
+    # （结果按行对齐或逐组独立处理，分组键无需排序）
+    volga = plot_df['volga']
+    volga_by_exp = volga.groupby(plot_df['expiration_date'], sort=False, observed=True)
+    volga_q70 = volga_by_exp.transform('quantile', 0.7)
+    volga_q30 = volga_by_exp.transform('quantile', 0.3)
+    iv_percentile = plot_df['iv_percentile'] if 'iv_percentile' in plot_df.columns else 50.0
+    
+    # 高Volga低IV（被低估）和低Volga高IV（被高估）的合约，每个到期日各取前5个
+    undervalued = plot_df[(volga > volga_q70) & (iv_percentile < 50)].groupby('expiration_date', sort=False, observed=True).head(5)
+    overvalued = plot_df[(volga < volga_q30) & (iv_percentile > 50)].groupby('expiration_date', sort=False, observed=True).head(5)
+    
+    def _leg_records(legs: pd.DataFrame) -> Dict:
+        # 配对只需要少数几列：先按到期日转成字典列表，内层循环不再为每行构造Series
+        records = pd.DataFrame({
+            'option_type': legs['option_type'],
+            'strike': legs['strike'],
+            'instrument': safe_get_instrument_names(legs),
+            **{g: legs[g] for g in _GREEK_COLUMNS},
+            'pnl_total': legs['pnl_total'],
+            'pnl_vol_total': legs['pnl_vol_total'],
+            'pnl_vol_volga': legs['pnl_vol_volga']
+        })
+        return {exp: group.to_dict('records') for exp, group in records.groupby(legs['expiration_date'], sort=False, observed=True)}
+    
+    buy_legs_by_exp = _leg_records(undervalued)
+    sell_legs_by_exp = _leg_records(overvalued)
+    
+    # 只保留评分Top 10的配对：最小堆的堆顶是当前第10名，低于它的配对直接淘汰，不构建策略字典
+    # （堆元素带负序号：同分时先出现的配对排在前面，与稳定排序结果一致）
+    top_pairs = []
+    pair_seq = 0
+    
+    # 只遍历两侧都有合约的到期日
+    for exp_date, buy_group in buy_legs_by_exp.items():
+        sell_group = sell_legs_by_exp.get(exp_date)
+        if sell_group is None:
             continue
+        exp_str = str(exp_date)[:10]  # 每个到期日只格式化一次
         
         # 尝试配对
-        for _, buy_leg in undervalued.head(5).iterrows():
-            for _, sell_leg in overvalued.head(5).iterrows():
+        for buy_leg in buy_group:
+            for sell_leg in sell_group:
                 # 确保是同一类型（Call或Put）
                 if buy_leg['option_type'] != sell_leg['option_type']:
                     continue
                 
-                portfolio = PortfolioAnalyzer()
-                portfolio.current_spot_price = spot_price
-                
-                buy_iv = buy_leg.get('mark_iv_decimal', buy_leg.get('mark_iv', 0.5))
-                if buy_iv > 1.0:
-                    buy_iv = buy_iv / 100.0
-                sell_iv = sell_leg.get('mark_iv_decimal', sell_leg.get('mark_iv', 0.5))
-                if sell_iv > 1.0:
-                    sell_iv = sell_iv / 100.0
-                
-                portfolio.add_position(str(exp_date)[:10], buy_leg['strike'], buy_leg['option_type'], 1, volatility=buy_iv)
-                portfolio.add_position(str(exp_date)[:10], sell_leg['strike'], sell_leg['option_type'], -1, volatility=sell_iv)
-                
-                greeks = portfolio.calculate_portfolio_greeks(spot_price)
+                # 组合Greeks：买入腿 - 卖出腿
+                greeks = _combine_greeks(buy_leg, sell_leg, -1)
                 
                 # 检查Delta和Vega是否接近中性
                 if abs(greeks['delta']) > 0.3 or abs(greeks['vega']) > 50:
                     continue
                 
                 combo_pnl = buy_leg['pnl_total'] - sell_leg['pnl_total']  # 买入-卖出
+                score = combo_pnl + greeks['volga'] * 10
                 
-                strategies.append({
-                    'strategy_type': 'Vol Arbitrage',
-                    'expiration_date': str(exp_date)[:10],
-                    'strike': f"{buy_leg['strike']:.0f}/{sell_leg['strike']:.0f}",
-                    'legs': [
-                        {'type': buy_leg['option_type'], 'strike': buy_leg['strike'], 'quantity': 1, 
-                         'instrument': safe_get_instrument_name(buy_leg), 'volga': buy_leg['volga']},
-                        {'type': sell_leg['option_type'], 'strike': sell_leg['strike'], 'quantity': -1,
-                         'instrument': safe_get_instrument_name(sell_leg), 'volga': sell_leg['volga']}
-                    ],
-                    'greeks': greeks,
-                    'pnl_total': combo_pnl,
-                    'pnl_vol_total': buy_leg['pnl_vol_total'] - sell_leg['pnl_vol_total'],
-                    'pnl_vol_volga': buy_leg['pnl_vol_volga'] - sell_leg['pnl_vol_volga'],
-                    'score': combo_pnl + greeks.get('volga', 0) * 10
-                })
-    
-    strategies.sort(key=lambda x: x['score'], reverse=True)
-    return strategies[:10]
+                entry = (score, -pair_seq, exp_str, buy_leg, sell_leg, greeks, combo_pnl)
+                pair_seq += 1
+                if len(top_pairs) < 10:
+                    heapq.heappush(top_pairs, entry)
+                elif score > top_pairs[0][0]:
+                    heapq.heapreplace(top_pairs, entry)
+    
+    # 只为入选的配对构建结果，按评分降序返回
+    strategies = []
+    for score, _, exp_str, buy_leg, sell_leg, greeks, combo_pnl in sorted(top_pairs, reverse=True):
+        strategies.append({
+            'strategy_type': 'Vol Arbitrage',
+            'expiration_date': exp_str,
+            'strike': f"{buy_leg['strike']:.0f}/{sell_leg['strike']:.0f}",
+            'legs': [
+                {'type': buy_leg['option_type'], 'strike': buy_leg['strike'], 'quantity': 1, 
+                 'instrument': buy_leg['instrument'], 'volga': buy_leg['volga']},
+                {'type': sell_leg['option_type'], 'strike': sell_leg['strike'], 'quantity': -1,
+                 'instrument': sell_leg['instrument'], 'volga': sell_leg['volga']}
+            ],
+            'greeks': greeks,
+            'pnl_total': combo_pnl,
+            'pnl_vol_total': buy_leg['pnl_vol_total'] - sell_leg['pnl_vol_total'],
+            'pnl_vol_volga': buy_leg['pnl_vol_volga'] - sell_leg['pnl_vol_volga'],
+            'score': score
+        })
+    
+    return strategies
 
 
 def render_strategy_recommender(df: pd.DataFrame, spot_price: float, risk_free_rate: float):
@@ -1556,30 +1813,32 @@ def render_strategy_recommender(df: pd.DataFrame, spot_price: float, risk_free_r
                 help="避免买入IV百分位过高的期权（可能被高估）"
             )
     
+    # 计算一次PnL，所有扫描器共用（与模块2共享按快照和情景的缓存）
+    # Greeks缺失的合约不会通过任何扫描条件，直接按 soa.rows 取有效行
+    soa = get_chain_soa(df)
+    plot_df = _attach_scenario_pnl(df.take(soa.rows), soa, spot_price, price_change_pct, iv_change_pct)
+    
     # 扫描策略
     all_strategies = []
     
     if "做多波动率凸性 (Long Vol Convexity)" in strategy_types:
         with st.spinner("正在扫描做多波动率凸性策略..."):
             strategies = scan_long_vol_convexity_strategies(
-                df, spot_price, price_change_pct, iv_change_pct,
-                min_volga, max_vega, max_iv_percentile
+                plot_df, spot_price, min_volga, max_vega, max_iv_percentile
             )
             all_strategies.extend(strategies)
     
     if "波动率套利 (Vol Arbitrage)" in strategy_types:
         with st.spinner("正在扫描波动率套利策略..."):
-            strategies = scan_vol_arbitrage_strategies(
-                df, spot_price, price_change_pct, iv_change_pct
-            )
+            strategies = scan_vol_arbitrage_strategies(plot_df, spot_price)
             all_strategies.extend(strategies)
     
     if not all_strategies:
         st.warning("未找到符合条件的策略组合。请尝试调整筛选条件。")
         return
     
-    # 按评分排序
-    all_strategies.sort(key=lambda x: x['score'], reverse=True)
+    # 按评分取Top 10（总数仍按全部候选显示）
+    top_strategies = heapq.nlargest(10, all_strategies, key=lambda x: x['score'])
     
     # 显示推荐策略
     st.subheader(f"📊 步骤4：查看推荐策略（共{len(all_strategies)}个，显示Top 10）")
@@ -1589,7 +1848,7 @@ def render_strategy_recommender(df: pd.DataFrame, spot_price: float, risk_free_r
     st.info("💡 **评分说明**：评分 = 预期总PnL + Volga × 10。"
            "评分同时考虑了收益（PnL）和凸性优势（Volga），评分越高表示策略在您设定的情景下表现越好。")
     
-    for idx, strategy in enumerate(all_strategies[:10], 1):
+    for idx, strategy in enumerate(top_strategies, 1):
         # 计算风险等级
         greeks = strategy['greeks']
         risk_level = "低"
@@ -8,9 +8,152 @@ import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
 from datetime import datetime, timedelta
+from typing import List, Dict
 from src.core import OptionsDatabase, PortfolioAnalyzer, BSCalculator
 from src.utils import load_data
-from views.volga_analysis import prepare_volga_data, calculate_full_pnl
+from views.volga_analysis import prepare_volga_data, calculate_pnl_components, format_numbers, top_k_positions
+
+
+def build_contract_lookup(volga_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    按 (到期日, 行权价, 类型) 建立快照合约查找表
+    同一键有多个合约时只保留第一条（与逐个筛选后取第一行一致）
+    
+    :param volga_df: prepare_volga_data 输出的快照数据
+    :return: 以 (expiration_date, strike, option_type) 为索引的DataFrame
+    """
+    keys = pd.MultiIndex.from_arrays([
+        pd.DatetimeIndex(volga_df['expiration_date']).normalize(),  # 按日期匹配，忽略时刻
+        volga_df['strike'].to_numpy(dtype=np.float64),
+        volga_df['option_type'].astype(str).to_numpy()
+    ], names=['expiration_date', 'strike', 'option_type'])
+    lookup = volga_df.set_axis(keys)
+    return lookup[~keys.duplicated(keep='first')]
+
+
+def match_positions(lookup: pd.DataFrame, positions: list) -> pd.DataFrame:
+    """
+    一次性为所有持仓匹配快照合约（一次reindex，无需逐个持仓扫描整条期权链）
+    
+    :param lookup: build_contract_lookup 返回的查找表
+    :param positions: 持仓列表（Position对象）
+    :return: 与持仓一一对应的快照行（未匹配到的持仓整行为NaN）
+    """
+    keys = pd.MultiIndex.from_arrays([
+        pd.DatetimeIndex([pos.expiration_date for pos in positions]).normalize(),
+        np.array([pos.strike for pos in positions], dtype=np.float64),
+        [pos.option_type for pos in positions]
+    ], names=lookup.index.names)
+    return lookup.reindex(keys)
+
+
+def build_risk_key(snapshot_key: str, spot_price: float, risk_free_rate: float, positions: list) -> tuple:
+    """
+    构建组合风险结果的复用键（快照、标的价格、利率、日期和所有影响Greeks/PnL的持仓属性）
+    
+    :param snapshot_key: prepare_volga_data 写入的快照键
+    :param spot_price: 标的价格
+    :param risk_free_rate: 无风险利率
+    :param positions: 持仓列表（Position对象）
+    :return: 可比较的键元组
+    """
+    return (
+        snapshot_key, spot_price, risk_free_rate, datetime.now().date(),
+        tuple((pos.expiration_date, pos.strike, pos.option_type, pos.quantity, pos.volatility, pos.entry_price)
+              for pos in positions)
+    )
+
+
+def generate_adjustment_suggestions(net_volga: float, net_vanna: float, net_vega: float) -> List[Dict]:
+    """
+    根据组合净敞口生成调整建议
+    
+    :param net_volga: 组合Net Volga
+    :param net_vanna: 组合Net Vanna
+    :param net_vega: 组合Net Vega
+    :return: 建议列表（type/reason/action）
+    """
+    suggestions = []
+    
+    # 建议1: Net Volga过高
+    if net_volga > 200:
+        suggestions.append({
+            'type': '降低Volga敞口',
+            'reason': f'当前Net Volga为{net_volga:.2f}，凸性敞口过高',
+            'action': '建议卖出部分高Volga合约，或买入低Volga合约对冲'
+        })
+    elif net_volga < -200:
+        suggestions.append({
+            'type': '增加Volga敞口',
+            'reason': f'当前Net Volga为{net_volga:.2f}，凹性敞口过大',
+            'action': '建议买入高Volga合约，或卖出低Volga合约'
+        })
+    
+    # 建议2: Net Vanna过高
+    if abs(net_vanna) > 0.01:
+        suggestions.append({
+            'type': '对冲Vanna敞口',
+            'reason': f'当前Net Vanna为{net_vanna:.6f}，价格×波动率交互敏感',
+            'action': '建议调整持仓结构，使Vanna接近中性'
+        })
+    
+    # 建议3: Volga/Vega比率不合理
+    if abs(net_vega) > 0.01:
+        volga_vega_ratio = net_volga / net_vega
+        if abs(volga_vega_ratio) > 2.0:
+            suggestions.append({
+                'type': '优化Volga/Vega比率',
+                'reason': f'当前Volga/Vega比率为{volga_vega_ratio:.4f}，可能不合理',
+                'action': '建议调整组合结构，使Volga/Vega比率在合理范围内（-2到2）'
+            })
+    
+    return suggestions
+
+
+def _describe_volga_hedge_candidates(volga_df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    从快照中选出Volga对冲候选合约：Volga最低（用于卖出对冲）和最高（用于增加敞口）的各3个
+    只需3个合约，用部分选择（argpartition，O(N)）代替分位数排序和整列筛选
+    
+    :param volga_df: prepare_volga_data 输出的快照数据
+    :return: {'low': [...], 'high': [...]} 格式化后的合约描述（low按Volga升序，high按降序）
+    """
+    volga = volga_df['volga'].to_numpy(dtype=np.float64)
+    contracts = volga_df[['option_type', 'strike', 'volga', 'vega']]
+    
+    def describe(positions: np.ndarray) -> List[str]:
+        return [f"{row.option_type} {row.strike:.0f} (Volga: {row.volga:.2f}, Vega: {row.vega:.2f})"
+                for row in contracts.take(positions).itertuples(index=False)]
+    
+    return {
+        'low': describe(top_k_positions(volga, 3, largest=False)),
+        'high': describe(top_k_positions(volga, 3, largest=True))
+    }
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _volga_hedge_candidates_cached(snapshot_key: str, _volga_df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    按快照缓存Volga对冲候选合约（同一快照下的重跑不再扫描整条期权链求分位数）
+    
+    :param snapshot_key: 快照键（_volga_df 本身不参与哈希）
+    :param _volga_df: prepare_volga_data 输出的快照数据（使用_前缀避免缓存哈希）
+    :return: {'low': [...], 'high': [...]} 格式化后的合约描述
+    """
+    return _describe_volga_hedge_candidates(_volga_df)
+
+
+def get_volga_hedge_candidates(volga_df: pd.DataFrame) -> Dict[str, List[str]]:
+    """
+    获取Volga对冲候选合约（有快照键时按快照缓存）
+    
+    :param volga_df: prepare_volga_data 输出的快照数据
+    :return: {'low': [...], 'high': [...]} 格式化后的合约描述
+    """
+    snapshot_key = volga_df.attrs.get('snapshot_key')
+    if not snapshot_key:
+        return _describe_volga_hedge_candidates(volga_df)
+    return _volga_hedge_candidates_cached(snapshot_key, volga_df)
 
 
 def render_volga_holding_view(db: OptionsDatabase):
@@ -75,7 +218,6 @@ def render_volga_holding_view(db: OptionsDatabase):
     # 初始化持仓分析器
     if 'volga_portfolio_analyzer' not in st.session_state:
         st.session_state['volga_portfolio_analyzer'] = PortfolioAnalyzer(risk_free_rate=risk_free_rate)
-        st.session_state['volga_portfolio_analyzer'].current_spot_price = spot_price
     
     analyzer = st.session_state['volga_portfolio_analyzer']
     analyzer.current_spot_price = spot_price
@@ -125,26 +267,27 @@ def render_volga_holding_view(db: OptionsDatabase):
             else:  # 从数据库选择
                 # 筛选可用合约
                 available_contracts = df[['instrument_name', 'strike', 'option_type', 'expiration_date', 
-                                         'mark_iv', 'mark_price']].drop_duplicates()
+                                         'mark_iv', 'mark_price']].drop_duplicates().reset_index(drop=True)
                 
                 if len(available_contracts) > 0:
-                    contract_options = []
-                    for idx, row in available_contracts.iterrows():
-                        label = f"{row['instrument_name']} | {row['strike']:.0f} {row['option_type']} | IV:{row['mark_iv']:.1f}%"
-                        contract_options.append((idx, label, row))
+                    # 显示标签按列向量化拼接；选择框按位置索引，选中后再用iloc取该行
+                    contract_labels = (available_contracts['instrument_name'].astype(str) + ' | ' +
+                                       format_numbers(available_contracts['strike'], '%.0f') + ' ' +
+                                       available_contracts['option_type'].astype(str) + ' | IV:' +
+                                       format_numbers(available_contracts['mark_iv'], '%.1f') + '%').tolist()
                     
                     selected_idx = st.selectbox(
                         "选择合约",
-                        options=range(len(contract_options)),
-                        format_func=lambda x: contract_options[x][1] if x < len(contract_options) else "无效"
+                        options=range(len(contract_labels)),
+                        format_func=lambda x: contract_labels[x] if x < len(contract_labels) else "无效"
                     )
                     
                     quantity = st.number_input("数量", min_value=-100, max_value=100, value=1, step=1,
                                               key="db_quantity")
                     
                     if st.button("添加持仓", width='stretch', key="add_from_db"):
-                        if 0 <= selected_idx < len(contract_options):
-                            _, _, contract = contract_options[selected_idx]
+                        if 0 <= selected_idx < len(contract_labels):
+                            contract = available_contracts.iloc[selected_idx]
                             analyzer.add_position(
                                 expiration_date=str(contract['expiration_date'])[:10],
                                 strike=float(contract['strike']),
@@ -195,62 +338,61 @@ def render_volga_holding_view(db: OptionsDatabase):
     with st.spinner("正在计算组合风险敞口..."):
         volga_df = prepare_volga_data(df, spot_price, risk_free_rate)
         
-        # 更新持仓的IV（使用最新市场快照）
-        updated_positions = []
-        for pos in analyzer.positions:
-            # 在快照中查找匹配的合约
-            pos_exp_date = pd.to_datetime(pos.expiration_date).date()
-            matching = volga_df[
-                (volga_df['strike'] == pos.strike) &
-                (volga_df['option_type'] == pos.option_type) &
-                (volga_df['expiration_date'].dt.date == pos_exp_date)
-            ]
+        # 风险结果只由快照、标的价格、利率、日期和持仓决定：输入不变的重跑（如展开说明/详情面板）直接复用上次结果
+        risk_key = build_risk_key(volga_df.attrs.get('snapshot_key'), spot_price, risk_free_rate, analyzer.positions)
+        if risk_key[0] and st.session_state.get('volga_holding_risk_key') == risk_key:
+            portfolio_greeks, portfolio_pnl_df, pnl_totals = st.session_state['volga_holding_risk']
+        else:
+            # 所有持仓一次性匹配快照合约（按 (到期日, 行权价, 类型) 建立查找表后整体reindex）
+            # 查找表只依赖快照（快照键已包含标的价格/利率），增删持仓时复用 session_state 中的查找表
+            if risk_key[0] and st.session_state.get('volga_holding_lookup_key') == risk_key[0]:
+                contract_lookup = st.session_state['volga_holding_lookup']
+            else:
+                contract_lookup = build_contract_lookup(volga_df)
+                if risk_key[0]:
+                    st.session_state['volga_holding_lookup'] = contract_lookup
+                    st.session_state['volga_holding_lookup_key'] = risk_key[0]
+            matched = match_positions(contract_lookup, analyzer.positions)
             
-            if len(matching) > 0:
-                # 使用最新快照的IV
-                latest_iv = matching.iloc[0].get('mark_iv_decimal', matching.iloc[0].get('mark_iv', pos.volatility))
-                if latest_iv > 1.0:
-                    latest_iv = latest_iv / 100.0
-                pos.volatility = latest_iv
-            updated_positions.append(pos)
-        
-        analyzer.positions = updated_positions
-        
-        # 计算组合Greeks
-        portfolio_greeks = analyzer.calculate_portfolio_greeks(spot_price)
-        
-        # 计算组合PnL（基于当前情景）
-        price_change_pct = 0.0  # 默认价格不变
-        iv_change_pct = 0.0  # 默认IV不变
-        
-        # 计算每个持仓的PnL贡献
-        portfolio_pnl_components = []
-        for pos in analyzer.positions:
-            pos_exp_date = pd.to_datetime(pos.expiration_date).date()
-            matching = volga_df[
-                (volga_df['strike'] == pos.strike) &
-                (volga_df['option_type'] == pos.option_type) &
-                (volga_df['expiration_date'].dt.date == pos_exp_date)
-            ]
+            # 更新持仓的IV（使用最新市场快照，未匹配到的持仓保留原IV）
+            # mark_iv_decimal 已由 prepare_volga_data 统一转换为小数，
+            # 不能再按 >1 判断除以100，否则IV超过100%的合约会被二次缩小
+            for pos, iv in zip(analyzer.positions, matched['mark_iv_decimal'].to_numpy()):
+                if not np.isnan(iv):
+                    pos.volatility = float(iv)
             
-            if len(matching) > 0:
-                contract_data = matching.iloc[0:1].copy()
-                contract_data = calculate_full_pnl(contract_data, spot_price, price_change_pct, iv_change_pct)
-                
-                if len(contract_data) > 0:
-                    contract = contract_data.iloc[0]
-                    portfolio_pnl_components.append({
-                        'position': f"{pos.option_type} {pos.strike:.0f}",
-                        'quantity': pos.quantity,
-                        'pnl_total': contract['pnl_total'] * pos.quantity,
-                        'pnl_price': contract['pnl_price_total'] * pos.quantity,
-                        'pnl_vol': contract['pnl_vol_total'] * pos.quantity,
-                        'pnl_volga': contract['pnl_vol_volga'] * pos.quantity,
-                        'pnl_interaction': contract['pnl_interaction'] * pos.quantity
-                    })
-        
-        portfolio_pnl_df = pd.DataFrame(portfolio_pnl_components)
-        total_pnl = portfolio_pnl_df['pnl_total'].sum() if len(portfolio_pnl_df) > 0 else 0.0
+            # 计算组合Greeks
+            portfolio_greeks = analyzer.calculate_portfolio_greeks_batch(spot_price)
+            
+            # 计算组合PnL（基于当前情景）
+            price_change_pct = 0.0  # 默认价格不变
+            iv_change_pct = 0.0  # 默认IV不变
+            
+            # 计算每个持仓的PnL贡献：已匹配的持仓一次性计算单位PnL归因，再整体乘以持仓数量
+            found = matched['mark_iv_decimal'].notna().to_numpy()
+            matched_rows = matched[found]
+            unit_pnl = calculate_pnl_components(matched_rows, spot_price, price_change_pct, iv_change_pct)
+            quantities = np.array([pos.quantity for pos in analyzer.positions])[found]
+            scale = quantities.astype(np.float64)
+            
+            portfolio_pnl_df = pd.DataFrame({
+                'position': (matched_rows.index.get_level_values('option_type') + ' ' +
+                             np.char.mod('%.0f', matched_rows.index.get_level_values('strike'))),
+                'quantity': quantities,
+                'pnl_total': unit_pnl['pnl_total'] * scale,
+                'pnl_price': unit_pnl['pnl_price_total'] * scale,
+                'pnl_vol': unit_pnl['pnl_vol_total'] * scale,
+                'pnl_volga': unit_pnl['pnl_vol_volga'] * scale,
+                'pnl_interaction': unit_pnl['pnl_interaction'] * scale
+            })
+            # 各归因分量合计一次归约得到（顺序：价格/波动率/Volga/交互/总计；无持仓匹配时全为0）
+            pnl_totals = portfolio_pnl_df[['pnl_price', 'pnl_vol', 'pnl_volga', 'pnl_interaction',
+                                           'pnl_total']].to_numpy(dtype=np.float64).sum(axis=0)
+            if risk_key[0]:
+                st.session_state['volga_holding_risk'] = (portfolio_greeks, portfolio_pnl_df, pnl_totals)
+                # 持仓IV已按快照刷新，按刷新后的属性记录键，下次重跑才能命中
+                st.session_state['volga_holding_risk_key'] = build_risk_key(
+                    risk_key[0], spot_price, risk_free_rate, analyzer.positions)
     
     # 风险仪表盘
     col1, col2, col3, col4, col5 = st.columns(5)
@@ -327,13 +469,9 @@ def render_volga_holding_view(db: OptionsDatabase):
         
         with col2:
             st.write("**组合总PnL**")
+            total_price_pnl, total_vol_pnl, total_volga_pnl, total_interaction_pnl, total_pnl = pnl_totals
             st.metric("总PnL", f"{total_pnl:.2f}")
             
-            total_price_pnl = portfolio_pnl_df['pnl_price'].sum()
-            total_vol_pnl = portfolio_pnl_df['pnl_vol'].sum()
-            total_volga_pnl = portfolio_pnl_df['pnl_volga'].sum()
-            total_interaction_pnl = portfolio_pnl_df['pnl_interaction'].sum()
-            
             st.write("**归因分解**")
             st.write(f"- 价格贡献: {total_price_pnl:.2f}")
             st.write(f"- 波动率贡献: {total_vol_pnl:.2f}")
@@ -345,39 +483,7 @@ def render_volga_holding_view(db: OptionsDatabase):
     # 调整建议引擎
     st.subheader("💡 调整建议")
     
-    suggestions = []
-    
-    # 建议1: Net Volga过高
-    if net_volga > 200:
-        suggestions.append({
-            'type': '降低Volga敞口',
-            'reason': f'当前Net Volga为{net_volga:.2f}，凸性敞口过高',
-            'action': '建议卖出部分高Volga合约，或买入低Volga合约对冲'
-        })
-    elif net_volga < -200:
-        suggestions.append({
-            'type': '增加Volga敞口',
-            'reason': f'当前Net Volga为{net_volga:.2f}，凹性敞口过大',
-            'action': '建议买入高Volga合约，或卖出低Volga合约'
-        })
-    
-    # 建议2: Net Vanna过高
-    if abs(net_vanna) > 0.01:
-        suggestions.append({
-            'type': '对冲Vanna敞口',
-            'reason': f'当前Net Vanna为{net_vanna:.6f}，价格×波动率交互敏感',
-            'action': '建议调整持仓结构，使Vanna接近中性'
-        })
-    
-    # 建议3: Volga/Vega比率不合理
-    if abs(net_vega) > 0.01:
-        volga_vega_ratio = net_volga / net_vega
-        if abs(volga_vega_ratio) > 2.0:
-            suggestions.append({
-                'type': '优化Volga/Vega比率',
-                'reason': f'当前Volga/Vega比率为{volga_vega_ratio:.4f}，可能不合理',
-                'action': '建议调整组合结构，使Volga/Vega比率在合理范围内（-2到2）'
-            })
+    suggestions = generate_adjustment_suggestions(net_volga, net_vanna, net_vega)
     
     if suggestions:
         for idx, suggestion in enumerate(suggestions, 1):
@@ -385,24 +491,19 @@ def render_volga_holding_view(db: OptionsDatabase):
                 st.write(f"**原因**: {suggestion['reason']}")
                 st.write(f"**行动**: {suggestion['action']}")
                 
-                # 尝试从市场快照中找到调整建议的具体合约
+                # 尝试从市场快照中找到调整建议的具体合约（候选合约按快照缓存）
                 if 'Volga' in suggestion['type']:
+                    hedge_candidates = get_volga_hedge_candidates(volga_df)
                     if net_volga > 0:
-                        # 寻找低Volga合约（用于卖出对冲）
-                        low_volga = volga_df[volga_df['volga'] < volga_df['volga'].quantile(0.3)]
-                        if len(low_volga) > 0:
-                            st.write("**推荐合约（用于对冲）**:")
-                            for _, contract in low_volga.head(3).iterrows():
-                                st.write(f"- {contract['option_type']} {contract['strike']:.0f} "
-                                       f"(Volga: {contract['volga']:.2f}, Vega: {contract['vega']:.2f})")
+                        # 低Volga合约（用于卖出对冲）
+                        title, contracts = "**推荐合约（用于对冲）**:", hedge_candidates['low']
                     else:
-                        # 寻找高Volga合约（用于买入）
-                        high_volga = volga_df[volga_df['volga'] > volga_df['volga'].quantile(0.7)]
-                        if len(high_volga) > 0:
-                            st.write("**推荐合约（用于增加敞口）**:")
-                            for _, contract in high_volga.head(3).iterrows():
-                                st.write(f"- {contract['option_type']} {contract['strike']:.0f} "
-                                       f"(Volga: {contract['volga']:.2f}, Vega: {contract['vega']:.2f})")
+                        # 高Volga合约（用于买入）
+                        title, contracts = "**推荐合约（用于增加敞口）**:", hedge_candidates['high']
+                    if contracts:
+                        st.write(title)
+                        for contract in contracts:
+                            st.write(f"- {contract}")
     else:
         st.success("✅ **当前持仓结构良好**，无需调整建议。")
     